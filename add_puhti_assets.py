@@ -7,6 +7,7 @@ import pandas as pd
 from urllib.parse import urljoin
 
 from utils.json_convert import convert_json_to_geoserver
+from utils.stac_api import iter_item_dicts, get_item
 
 if __name__ == "__main__":
 
@@ -31,17 +32,22 @@ if __name__ == "__main__":
     catalog = pystac_client.Client.open(f"{args.host}/geoserver/ogc/stac/v1/", headers={"User-Agent":"update-script"})
     collections = args.collections
 
+    session = requests.Session()
+
     for collection in collections:
         stac_col = catalog.get_child(collection)
-        items = list(stac_col.get_items())
-        number_of_items = len(items)
+
+        # Only the IDs and the assets are fetched for finding the Items without Puhti assets
+        item_assets = {item["id"]: item.get("assets", {}) for item in iter_item_dicts(stac_col, ("id", "assets"), session=session)}
+        number_of_items = len(item_assets)
+        # If Puhti assets added for some Items, skip them
+        item_ids_to_update = [item_id for item_id in item_assets if not any(puhti_pattern in asset_id for asset_id in item_assets[item_id])]
         added_puhti_link_count = 0
-        
-        for item in items:
+
+        # Only the full Items that are updated are fetched, one by one
+        for item_id in item_ids_to_update:
+            item = get_item(stac_col, item_id, session)
             assets = item.assets
-            # If Puhti assets added for some Items, skip them
-            if any(puhti_pattern in asset_id for asset_id in assets):
-                continue
             cloned_assets = []
             for asset in assets:
                 cloned_asset = assets[asset].clone()
@@ -58,11 +64,13 @@ if __name__ == "__main__":
             item_dict = item.to_dict()
             converted_item = convert_json_to_geoserver(item_dict)
             request_point = f"collections/{stac_col.id}/products/{item.id}"
-            r = requests.put(urljoin(app_host, request_point), json=converted_item, auth=("admin", pwd), headers={"User-Agent":"update-script"})
+            r = session.put(urljoin(app_host, request_point), json=converted_item, auth=("admin", pwd), headers={"User-Agent":"update-script"})
             r.raise_for_status()
             added_puhti_link_count += 1
 
         if added_puhti_link_count == 0:
             print(f"All Puhti links are already added for {stac_col.id}.")
         else:
-            print(f"+ Added all Puhti links for {stac_col.id}. Number of additions: {added_puhti_link_count}/{number_of_items}")
\ No newline at end of file
+            print(f"+ Added all Puhti links for {stac_col.id}. Number of additions: {added_puhti_link_count}/{number_of_items}")
+
+    session.close()
@@ -1,9 +1,10 @@
-from pystac import Catalog, Collection
+from pystac import Catalog
 import pystac
-import rasterio
-import urllib.request, json
+import argparse
 
 from utils.retry_errors import retry_errors
+from utils.fmi import create_fetch_session, fetch_items, fetch_item, fetch_collections, add_raster_metadata
+from utils.raster_metadata import open_metadata_cache, close_metadata_cache
 
 fmi_collections = [
     "https://pta.data.lit.fmi.fi/stac/catalog/Sentinel-2_global_mosaic_vuosi/Sentinel-2_global_mosaic_vuosi.json",
@@ -485,46 +486,23 @@ news_ids = {
     "Tuulituhoriski": "daily_wind_damage_risk_at_fmi"
 }
 
-def create_fmi_collections(root_catalog):
+def create_fmi_collections(root_catalog, workers=8, timeout=30):
 
-    collections = []
-    for collection in fmi_collections:
-        try:
-            collections.append(Collection.from_file(collection))
-        except ValueError:
-            with urllib.request.urlopen(collection) as url:
-                data = json.load(url)
-                data["extent"]["temporal"]["interval"] = [data["extent"]["temporal"]["interval"]]
-                collections.append(Collection.from_dict(data))
+    session = create_fetch_session(workers)
+
+    # The Collections are downloaded once and the known errors in their JSON are fixed before reading them
+    collections = fetch_collections(fmi_collections, workers, timeout, session)
 
     for collection in collections:
 
         collection.id = news_ids[collection.id]
         print(f"Creating {collection.id}")
-        
-        collection_links = collection.get_child_links()
-
-        sub_collections = []
-        for link in collection_links:
-            try:
-                sub_collections.append(Collection.from_file(link.target))
-            except ValueError:
-                with urllib.request.urlopen(link.target) as url:
-                    data = json.load(url)
-                    data["extent"]["temporal"]["interval"] = [data["extent"]["temporal"]["interval"]]
-                    sub_collections.append(Collection.from_dict(data))
 
-        item_links = list(set([link.target for sub in sub_collections for link in sub.get_item_links()]))
+        sub_collections = fetch_collections([link.get_absolute_href() for link in collection.get_child_links()], workers, timeout, session)
 
-        items = []
-        errors = []
+        item_links = list(set([link.get_absolute_href() for sub in sub_collections for link in sub.get_item_links()]))
 
-        for i,item in enumerate(item_links):
-            try:
-                items.append(pystac.Item.from_file(item))
-            except Exception as e:
-                print(f" - ERROR {e} in item {item} #{i}")
-                errors.append(item)
+        items, errors = fetch_items(item_links, workers, timeout, session)
         print(f" + Number of items: {len(items)}")
 
         collection.remove_links("child")
@@ -559,30 +537,22 @@ def create_fmi_collections(root_catalog):
             ))
 
         # If there were connection errors during the item making process, the item generation for errors is retried
+        # The items that could not be retrieved after the retries are left out of the collection
         if len(errors) > 0:
-            retry_errors(items, errors)
-            print(" + All errors fixed")
+            dead_letters = retry_errors(items, errors, fetch=lambda link: fetch_item(session, link, timeout), workers=workers)
+            if dead_letters:
+                print(f" - {len(dead_letters)} items left out of {collection.id}")
+            else:
+                print(" + All errors fixed")
 
-        for i,item in enumerate(items):
+        # The items whose file can't be read are left out of the collection
+        unreadable = add_raster_metadata(items, workers)
+        for failed in unreadable:
+            print(f" - ERROR {failed['error']} in {failed['href']}, leaving out {failed['item'].id}")
+        unreadable_ids = {failed["item"].id for failed in unreadable}
+        items = [item for item in items if item.id not in unreadable_ids]
 
-            with rasterio.open(next(iter(item.assets.values())).href) as src:
-                item.extra_fields["gsd"] = src.res[0]
-                # 9391 EPSG code is false, replace by the standard 3067
-                if src.crs.to_epsg() == 9391:
-                    item.properties["proj:epsg"] = 3067
-                else:
-                    item.properties["proj:epsg"] = src.crs.to_epsg()
-                item.properties["proj:transform"] = [
-                    src.transform.a,
-                    src.transform.b,
-                    src.transform.c,
-                    src.transform.d,
-                    src.transform.e,
-                    src.transform.f,
-                    src.transform.g,
-                    src.transform.h,
-                    src.transform.i
-                ]
+        for i,item in enumerate(items):
 
             for asset in item.assets:
                 if item.assets[asset].roles is not list:
@@ -601,5 +571,16 @@ def create_fmi_collections(root_catalog):
 
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=8, help="Number of Items downloaded at the same time")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for each Item download")
+    parser.add_argument("--no_cache", action="store_true", help="Read the raster headers from the files instead of the local cache")
+    args = parser.parse_args()
+
+    if not args.no_cache:
+        open_metadata_cache()
+
     root_catalog = Catalog(id="FMI", description="FMI catalog", catalog_type= pystac.CatalogType.RELATIVE_PUBLISHED)
-    create_fmi_collections(root_catalog)
+    create_fmi_collections(root_catalog, args.workers, args.timeout)
+
+    close_metadata_cache()
@@ -1,18 +1,17 @@
 import pystac
-import psycopg2
-import rasterio
-import requests
 import datetime
 import getpass
 import argparse
 import re
 import os
 import json
-from rio_stac.stac import create_stac_item
-from shapely.geometry import GeometryCollection, shape
-from bs4 import BeautifulSoup
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-from utils.paituli import recursive_filecheck, generate_item_id, generate_timestamps, generate_metadata_links
+from utils.paituli_db import open_db_pool, close_db_pool, db_connection, select_datasets, stream_index_rows
+from utils.listing_cache import open_listing_cache, close_listing_cache
+from utils.raster_metadata import open_metadata_cache, close_metadata_cache, read_raster_metadata, create_item_from_metadata
+from utils.paituli import list_directory_files, generate_item_id, generate_timestamps, generate_metadata_links, create_data_asset, get_item_epsg, resolve_file
 
 online_data_prefix = "https://www.nic.funet.fi/index/geodata/"
 puhti_data_prefix = "/appl/data/geo/"
@@ -117,10 +116,16 @@ def create_collection(catalog, data_dict) -> pystac.Collection:
     catalog.add_child(collection)
     return collection
 
-def create_item(path, collection, data_dict, item_media_type, label) -> pystac.Item:
+def read_item(path, item_index, data_dict, item_media_type, label) -> dict:
     """
+    Reads the metadata of a single file. This is run in the worker threads, so the collection is not modified here.
+    item_index is a dictionary of the Items already in the collection with the Item ID as the key.
+    If the Item ID is already in it, only the asset is made.
+
+    Returns a dictionary with the Item ID, the asset ID, the asset and the new Item (None if the Item exists).
+
     A bunch of different scenarios for timestamps:
-     - If dataset has only the latest data, get the Last-Modified header from the file
+     - If dataset has only the latest data, get the modification time of the file from the folder listing
      - If the database year has a span of multiple years, set the timespan accordingly
      - If the dataset contains monthly data, get the year and month from filename
      - Else, try to get the year from the full path of the file
@@ -130,97 +135,311 @@ def create_item(path, collection, data_dict, item_media_type, label) -> pystac.I
     item_timestamps = generate_timestamps(path, data_dict, label)
 
     item_id = generate_item_id(path, data_dict, item_timestamps["item_date"], label)
-    
-    collection_item_ids = {item.id for item in collection.get_items()}
 
     # There are files which have case-sensitive file-extensions
-    # If the default extension returns 404, switch it to uppercase
-    r = requests.head(path)
-    if r.status_code == 404:
-        address = os.path.dirname(path)
-        filename = os.path.basename(path)
-        current_extension = os.path.splitext(filename)[1]
-        new_filename = os.path.splitext(filename)[0] + current_extension.upper()
-        path = os.path.join(address, new_filename)
+    # The right extension and the modification time are taken from the folder listing
+    path, last_modified = resolve_file(path)
 
     asset_id = f"{data_dict['stac_id']}_{item_media_type.lower()}"
 
-    with rasterio.open(path) as src:
-        asset = pystac.Asset(
-            href = path, 
-            media_type = media_types[item_media_type]["mime"], 
-            title = asset_id,
-            roles = ["data"],
-            extra_fields = {
-                "gsd": float(src.res[0]),
-                "proj:shape": src.shape,
-                "proj:transform": [
-                    src.transform.a,
-                    src.transform.b,
-                    src.transform.c,
-                    src.transform.d,
-                    src.transform.e,
-                    src.transform.f,
-                    src.transform.g,
-                    src.transform.h,
-                    src.transform.i
-                ]
-            }
-        )
-        if item_media_type != "NetCDF":
-            if src.crs:
-                item_epsg = src.crs.to_epsg(confidence_threshold=50)
-            else:
-                if data_dict["coord_sys"] == "ETRS-TM35FIN" or data_dict["coord_sys"] == "WGS84/ETRS-TM35FIN":
-                    item_epsg = 3067
-                else:
-                    kkj_codes = {
-                            "kkj": 4123,
-                            "kkj0": 3386,
-                            "kkj1": 2391,
-                            "kkj2": 2392,
-                            "kkj3": 2393,
-                            "kkj4": 2394,
-                            "kkj5": 3387
-                        }
-                    if "compress95" in path:
-                        # Take the KKJ Zone from the path
-                        path_kkj = path.split("/")[-7]
-                        if path_kkj in kkj_codes:
-                            item_epsg = kkj_codes[path_kkj]
-                    elif "thematic_rasters" in data_dict["stac_id"]:
-                        item_epsg = kkj_codes["kkj3"]
-
-        else: # NetCDF datasets are in 3067
-            item_epsg = 3067
-
-    if item_id not in collection_item_ids:
-        item = create_stac_item(
-            path,
-            id = item_id,
-            assets = {
-                asset_id : asset
-            },
-            asset_media_type = media_types[item_media_type]["mime"], 
-            with_proj = True
-        )
+    metadata = read_raster_metadata(path, last_modified)
+    asset = create_data_asset(path, metadata, asset_id, media_types[item_media_type]["mime"])
+    item_epsg = get_item_epsg(metadata["epsg"], path, data_dict, item_media_type)
+
+    if item_id not in item_index:
+        item = create_item_from_metadata(metadata, item_id, {asset_id: asset})
         item.extra_fields["gsd"] = item.assets[asset_id].extra_fields["gsd"]
         item.common_metadata.start_datetime = item_timestamps["item_start_time"]
         item.common_metadata.end_datetime = item_timestamps["item_end_time"]
         if item.properties["proj:epsg"] == None: item.properties["proj:epsg"] = item_epsg
         if item.properties["proj:epsg"] == 9391 or item.properties["proj:epsg"] == "EPSG:9391": item.properties["proj:epsg"] = 3067
+    else:
+        item = None
+
+    return {
+        "item_id": item_id,
+        "asset_id": asset_id,
+        "asset": asset,
+        "item": item
+    }
+
+def add_item(item_data, collection, item_index) -> pystac.Item:
+    """
+    Adds the Item made by read_item to the collection and the item_index.
+    If an Item with the same ID was added already, only the asset is added to it.
+    This is run in the main thread in the order the files were read, so the result does not depend on the threads.
+    """
+
+    if item_data["item_id"] not in item_index:
+        item = item_data["item"]
         collection.add_item(item)
+        item_index[item.id] = item
         print(f"* Item made: {item.id}")
     else:
-        item = collection.get_item(item_id)
+        item = item_index[item_data["item_id"]]
         item.add_asset(
-            key = asset_id,
-            asset = asset
+            key = item_data["asset_id"],
+            asset = item_data["asset"]
         )
         print(f"** Asset made for {item.id}")
 
     return item
 
+def update_extent(extent, item) -> None:
+    """
+    Grows the running extent of a collection with the bbox and the timespan of the given Item.
+    The extent is a dictionary with the keys bbox, start and end, which are None until the first Item is added.
+    """
+
+    bbox = item.bbox
+    if extent["bbox"] is None:
+        extent["bbox"] = list(bbox[:4])
+    else:
+        extent["bbox"] = [
+            min(extent["bbox"][0], bbox[0]),
+            min(extent["bbox"][1], bbox[1]),
+            max(extent["bbox"][2], bbox[2]),
+            max(extent["bbox"][3], bbox[3])
+        ]
+
+    start_time = item.common_metadata.start_datetime
+    end_time = item.common_metadata.end_datetime
+    if start_time and (extent["start"] is None or start_time < extent["start"]):
+        extent["start"] = start_time
+    if end_time and (extent["end"] is None or end_time > extent["end"]):
+        extent["end"] = end_time
+
+def read_items(files, item_index, data_dict, item_media_type, workers):
+    """
+    Reads the given files concurrently with read_item and yields the file, the read data and the error in the same order as the files were given.
+    The number of files being read at a time is bounded, so the whole dataset is not queued at once.
+    If reading a file fails, the read data is None and the error is the exception, so one bad file does not stop the others.
+
+    files - List of dictionaries with the path and the label of the file
+    workers - Number of worker threads
+    """
+
+    def result(file, future):
+        try:
+            return file, future.result(), None
+        except Exception as e:
+            return file, None, e
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_progress = deque()
+        for file in files:
+            future = executor.submit(read_item, file["path"], item_index, data_dict, item_media_type, file["label"])
+            in_progress.append((file, future))
+            if len(in_progress) >= workers * 2:
+                yield result(*in_progress.popleft())
+        while in_progress:
+            yield result(*in_progress.popleft())
+
+def get_collection(catalog, data_dict) -> pystac.Collection:
+    """
+    Returns the collection of the dataset from the catalog or makes a new one if it's not in the catalog yet.
+    If the collection exists, the scale and the coordinate system of the dataset are added to it if they're missing.
+    """
+
+    catalog_collection_ids = {collection.id for collection in catalog.get_collections()}
+
+    if data_dict["stac_id"] in catalog_collection_ids:
+        collection = catalog.get_child(data_dict["stac_id"])
+        # If multiple scales or coordinate systems, add them to the description
+        coord_pattern = r"Coordinate systems:\s*(.*?)\."
+        scale_pattern = r"Scale:\s*(.*?)\."
+
+        if data_dict["scale"] not in collection.extra_fields["scale"]:
+            match = re.search(scale_pattern, collection.description)
+            collection.description = collection.description.replace(match.group(1), f"{match.group(1)}, {data_dict['scale']}")
+            collection.extra_fields["scale"].append(data_dict["scale"])
+            # If multiple scales, remove scale from Title
+            collection.title = f"{data_dict['name_eng']} (Paituli)"
+
+        if data_dict["coord_sys"] not in collection.extra_fields["coord_sys"]:
+            match = re.search(coord_pattern, collection.description)
+            collection.description = collection.description.replace(match.group(1), f"{match.group(1)}, {data_dict['coord_sys']}")
+            collection.extra_fields["coord_sys"].append(data_dict["coord_sys"])
+    else:
+        collection = create_collection(catalog, data_dict)
+
+    return collection
+
+def get_dataset_files(rows, item_media_type):
+    """
+    Yields the files of the index_wgs84 rows of a dataset as dictionaries with the data_id, the path, the label and the GeoJSON of the row.
+    The files are yielded as they are found, so reading them can start before all the folders are crawled.
+
+    rows - Iterable of the index_wgs84 rows as dictionaries
+    item_media_type - String of the media type of the dataset
+    """
+
+    extension = media_types[item_media_type]["ext"]
+
+    for row in rows:
+
+        # Check if file path ends in a file or is the path marked with "*". Lastly if none match, the filelinks are taken from the folder listings
+        if row["path"].endswith(extension):
+            data_paths = [online_data_prefix+row["path"]]
+        elif row["path"].endswith(".*"):
+            data_paths = [online_data_prefix+row["path"].replace("*", extension)]
+        elif row["path"].endswith("*"):
+            data_paths = [online_data_prefix+row["path"].replace("*", f".{extension}")]
+        else:
+            # Crawl the folder and its subfolders for the files
+            if not row["path"].endswith("/"):
+                item_path = row["path"] + "/"
+            else:
+                item_path = row["path"]
+
+            item_links = [link for link in list_directory_files(online_data_prefix + item_path) if link.endswith(extension)]
+            data_paths = [online_data_prefix + item_path + link for link in item_links]
+
+        for data_path in data_paths:
+            yield {"data_id": row["data_id"], "path": data_path, "label": row["label"], "geojson": row["geojson"]}
+
+def read_journal(journal_path) -> tuple[set, dict, dict]:
+    """
+    Reads the journal of an interrupted run.
+    Returns a set of the (data_id, path) pairs of the files that were done, a dictionary of the last state of each journaled Item
+    as a dictionary, grouped by the collection ID, and a dictionary of the files that failed with the (data_id, path) pair as the key.
+    A failed file that was done on a later try is not in the failed files.
+    """
+
+    completed = set()
+    journal_items = {}
+    failed_files = {}
+
+    with open(journal_path) as journal:
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line can be cut if the run was killed while writing it
+                continue
+            if record.get("failed"):
+                failed_files[(record["data_id"], record["path"])] = record
+                continue
+            completed.add((record["data_id"], record["path"]))
+            failed_files.pop((record["data_id"], record["path"]), None)
+            journal_items.setdefault(record["collection"], {})[record["item"]["id"]] = record["item"]
+
+    return completed, journal_items, failed_files
+
+def write_journal(journal, file, collection, item) -> None:
+    """
+    Writes a done file and the current state of its Item to the journal. The line is flushed right away, so it survives a crash.
+    """
+
+    item_dict = item.to_dict(include_self_link=False, transform_hrefs=False)
+    item_dict["links"] = []
+    item_dict.pop("collection", None)
+    record = {
+        "data_id": file["data_id"],
+        "path": file["path"],
+        "collection": collection.id,
+        "item": item_dict
+    }
+    journal.write(json.dumps(record, default=str) + "\n")
+    journal.flush()
+
+def write_failed_journal(journal, file, collection, error) -> None:
+    """
+    Writes a file that could not be read to the journal, so a resumed run can skip it.
+    """
+
+    record = {
+        "data_id": file["data_id"],
+        "path": file["path"],
+        "collection": collection.id,
+        "failed": True,
+        "error": str(error)
+    }
+    journal.write(json.dumps(record, default=str) + "\n")
+    journal.flush()
+
+def ingest_dataset(catalog, data_dict, rows, build, workers) -> pystac.Collection:
+    """
+    Makes the Items of a single dataset into its collection. All formats go through here.
+    If an Item with the same ID already exists, as with the NetCDF datasets, the file is added as an asset to that Item.
+
+    rows - Iterable of the index_wgs84 rows of the dataset as dictionaries
+    build - Dictionary of the state of the whole run:
+     - item_indexes: Item ID indexes of the collections with the collection ID as the key
+     - extents: Running extents of the collections with the collection ID as the key
+     - journal: Open journal file where the done files are written
+     - completed: Set of the (data_id, path) pairs done in an earlier run, which are skipped
+     - journal_failed: Files that failed in an earlier run with the (data_id, path) pair as the key, skipped unless retry_failed is set
+     - retry_failed: If True, the files that failed in an earlier run are read again
+     - failed_files: List where the files that could not be read in this run or were skipped as failed are added
+     - journal_items: Items from the journal of an earlier run, which are added when their collection is first indexed
+    workers - Number of files read at the same time
+    """
+
+    collection = get_collection(catalog, data_dict)
+    item_indexes = build["item_indexes"]
+    extents = build["extents"]
+
+    # Index the Items of the collection and collect their extent once, both are updated when new Items are made
+    if collection.id not in item_indexes:
+        item_indexes[collection.id] = {}
+        extents[collection.id] = {"bbox": None, "start": None, "end": None}
+        for item in collection.get_items():
+            item_indexes[collection.id][item.id] = item
+
+        # The journaled Items of a resumed run replace the ones from the saved catalog
+        journal_items = build["journal_items"].pop(collection.id, {})
+        for item_dict in journal_items.values():
+            item = pystac.Item.from_dict(item_dict)
+            if item.id in item_indexes[collection.id]:
+                collection.remove_item(item.id)
+            collection.add_item(item)
+            item_indexes[collection.id][item.id] = item
+        if journal_items:
+            print(f"* {len(journal_items)} Items restored from the journal for {collection.id}")
+
+        for item in item_indexes[collection.id].values():
+            update_extent(extents[collection.id], item)
+    item_index = item_indexes[collection.id]
+    extent = extents[collection.id]
+
+    item_media_type = data_dict["format_eng"].split(",")[0]
+    def pending(file):
+        key = (file["data_id"], file["path"])
+        if key in build["completed"]:
+            return False
+        # The files that failed in the interrupted run are skipped, so a bad file does not stop the resumed run at the same place
+        if key in build["journal_failed"] and not build["retry_failed"]:
+            build["failed_files"].append({"path": file["path"], "collection": collection.id, "error": f"Skipped, failed earlier: {build['journal_failed'][key]['error']}"})
+            return False
+        return True
+
+    files = (file for file in get_dataset_files(rows, item_media_type) if pending(file))
+
+    for file, item_data, error in read_items(files, item_index, data_dict, item_media_type, workers):
+        if error is not None:
+            print(f"! Could not read {file['path']}: {error}")
+            build["failed_files"].append({"path": file["path"], "collection": collection.id, "error": str(error)})
+            write_failed_journal(build["journal"], file, collection, error)
+            continue
+
+        stac_item = add_item(item_data, collection, item_index)
+
+        # If rio-stac does not get the geometry from the file, insert it from the database using geom transformed to a GeoJSON
+        if stac_item.bbox == [-180.0,-90.0,180.0,90.0]:
+            geojson = json.loads(file["geojson"])
+            stac_item.geometry = geojson
+            stac_item.bbox = pystac.utils.geometry_to_bbox(geojson)
+
+        update_extent(extent, stac_item)
+        write_journal(build["journal"], file, collection, stac_item)
+
+    if extent["bbox"] is not None:
+        collection.extent.spatial = pystac.SpatialExtent([extent["bbox"]])
+        collection.extent.temporal = pystac.TemporalExtent([[extent["start"], extent["end"]]])
+
+    return collection
+
 if __name__ == "__main__":
 
     dir_path = os.path.dirname(os.path.realpath(__file__))
@@ -230,6 +449,10 @@ if __name__ == "__main__":
     parser.add_argument("--pwd", type=str, help="Password for paituli database")
     parser.add_argument("--collections", nargs="+", help="Specific collections to be made")
     parser.add_argument("--db_host", type=str, help="Hostname of the Paituli DB", required=True)
+    parser.add_argument("--no_cache", action="store_true", help="Fetch all the folder listings and raster metadata from the sources instead of using the caches")
+    parser.add_argument("--workers", type=int, default=8, help="Number of files read at the same time")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted run from its journal")
+    parser.add_argument("--retry_failed", action="store_true", help="With --resume, read again the files that failed in the interrupted run")
 
     args = parser.parse_args()
     paituli_port = args.port
@@ -243,239 +466,95 @@ if __name__ == "__main__":
     if args.collections:
         selected_collections = args.collections
 
+    if not args.no_cache:
+        open_listing_cache()
+        open_metadata_cache()
+
     try:
         catalog = pystac.Catalog.from_file(f"{dir_path}/Paituli/catalog.json")
     except:
         catalog = pystac.Catalog("Paituli", "Paituli Catalog", catalog_type=pystac.CatalogType.RELATIVE_PUBLISHED)
 
-    conn = psycopg2.connect(f"host={args.db_host} port={paituli_port} user=paituli-ro password={paituli_pwd} dbname=paituli")
-
-    with conn.cursor() as curs:
-
-        if selected_collections:
-            data = (selected_collections,)
-            query = "select data_id, stac_id, org_eng, name_eng, scale, year, format_eng, coord_sys, license_url, meta from dataset where access=1 and stac_id=ANY(%s)"
-            curs.execute(query, data)
-        else:
-            query = "select data_id, stac_id, org_eng, name_eng, scale, year, format_eng, coord_sys, license_url, meta from dataset where access=1 and stac_id IS NOT NULL"
-            curs.execute(query)
+    open_db_pool(args.db_host, paituli_port, paituli_pwd, maxconn=1)
 
+    # The datasets and their index rows are read in one snapshot, so they match even if the DB is updated during the run
+    with db_connection(snapshot=True) as conn:
         datasets = {}
-        for result in curs:
-            new_dict = dict(zip(["data_id", "stac_id", "org_eng", "name_eng", "scale", "year", "format_eng", "coord_sys", "license_url", "metadata"], result))
+        for new_dict in select_datasets(conn, selected_collections):
             if new_dict["stac_id"]:
                 datasets[new_dict["data_id"]] = {key: value for key, value in new_dict.items() if key != 'data_id'}
 
-    if selected_collections:
-        failed_collections = 0
-        for collection in selected_collections:
-            if not any(collection in dataset.values() for dataset in datasets.values()):
-                print(f"! Collection \"{collection}\" not found, make sure the ID is correct.")
-                failed_collections = failed_collections + 1
+        if selected_collections:
+            failed_collections = 0
+            for collection in selected_collections:
+                if not any(collection in dataset.values() for dataset in datasets.values()):
+                    print(f"! Collection \"{collection}\" not found, make sure the ID is correct.")
+                    failed_collections = failed_collections + 1
     
-        if len(selected_collections) == failed_collections:
-            raise ValueError("No valid collection IDs provided.")
+            if len(selected_collections) == failed_collections:
+                raise ValueError("No valid collection IDs provided.")
     
-    # Group the datasets to NetCDF and The Others
-    netcdf_datasets = {x : datasets[x] for x in datasets if datasets[x]['format_eng'] == "NetCDF"}
-    regular_datasets = {y : datasets[y] for y in datasets if y not in netcdf_datasets.keys()}
-
-    for dataset in regular_datasets:
-
-        data_dict = datasets[dataset]
-        stac_id = data_dict["stac_id"]
+        # The done files and their Items are written to a journal, so an interrupted run can be continued with --resume
+        journal_path = f"{dir_path}/Paituli_journal.jsonl"
+        # The journal of an interrupted run is not overwritten, it's either continued or removed by hand
+        if not args.resume and os.path.exists(journal_path) and os.path.getsize(journal_path) > 0:
+            raise FileExistsError(f"A journal of an interrupted run exists at {journal_path}. Continue the run with --resume or remove the journal.")
+        if args.resume and os.path.exists(journal_path):
+            completed, journal_items, journal_failed = read_journal(journal_path)
+            print(f"Resuming from the journal, {len(completed)} files already done, {len(journal_failed)} files failed")
+        else:
+            completed, journal_items, journal_failed = set(), {}, {}
+
+        build = {
+            "item_indexes": {},
+            "extents": {},
+            "journal": open(journal_path, "a"),
+            "completed": completed,
+            "journal_items": journal_items,
+            "journal_failed": journal_failed,
+            "retry_failed": args.retry_failed,
+            "failed_files": []
+        }
 
-        if selected_collections: 
-        # Run with selected datasets
-            if stac_id not in selected_collections:
-                continue
+        # NetCDF datasets are ingested last, so their files are added as assets to the Items made from the other formats
+        ordered_datasets = sorted(datasets, key=lambda data_id: datasets[data_id]["format_eng"] == "NetCDF")
 
-        catalog_collection_ids = {collection.id for collection in catalog.get_collections()}
-
-        if stac_id in catalog_collection_ids:
-            collection = catalog.get_child(stac_id)
-            # If multiple scales or coordinate systems, add them to the description
-            coord_pattern = r"Coordinate systems:\s*(.*?)\."
-            scale_pattern = r"Scale:\s*(.*?)\."
-
-            if data_dict["scale"] not in collection.extra_fields["scale"]:
-                match = re.search(scale_pattern, collection.description)
-                collection.description = collection.description.replace(match.group(1), f"{match.group(1)}, {data_dict['scale']}")
-                collection.extra_fields["scale"].append(data_dict["scale"])
-                # If multiple scales, remove scale from Title
-                collection.title = f"{data_dict['name_eng']} (Paituli)"
-
-            if data_dict["coord_sys"] not in collection.extra_fields["coord_sys"]:
-                match = re.search(coord_pattern, collection.description)
-                collection.description = collection.description.replace(match.group(1), f"{match.group(1)}, {data_dict['coord_sys']}")
-                collection.extra_fields["coord_sys"].append(data_dict["coord_sys"])
-        else:
-            collection = create_collection(catalog, data_dict)
-
-        with conn.cursor() as curs:
-
-            data = (dataset,)
-            query = "select gid, data_id, label, path, geom , ST_AsGeoJSON(geom) from index_wgs84 where index_wgs84.data_id=(%s)"
-            curs.execute(query, data)
-            items = {}
-            for i,result in enumerate(curs):
-                items[i] = dict(zip(["gid", "data_id", "label", "path", "geom", "geojson"], result))
-
-        item_media_type = data_dict["format_eng"].split(",")[0]
-
-        for i in items:
-
-            # Check if file path ends in a file or is the path marked with "*". Lastly if none match, the filelinks are taken via BeautifulSoup
-            if items[i]["path"].endswith(media_types[item_media_type]['ext']):
-                data_path = online_data_prefix+items[i]["path"]
-                stac_item = create_item(data_path, collection, data_dict, item_media_type, items[i]["label"])
-            elif items[i]["path"].endswith(".*"):
-                data_path = online_data_prefix+items[i]["path"].replace("*", media_types[item_media_type]["ext"])
-                stac_item = create_item(data_path, collection, data_dict, item_media_type, items[i]["label"])
-            elif items[i]["path"].endswith("*"):
-                data_path = online_data_prefix+items[i]["path"].replace("*", f".{media_types[item_media_type]['ext']}")
-                stac_item = create_item(data_path, collection, data_dict, item_media_type, items[i]["label"])
-            else:
-                # Check folder contents with BeautifulSoup
-                page_url = online_data_prefix+items[i]["path"]
-                page = requests.get(page_url)
-                data = page.text
-                soup = BeautifulSoup(data, features="html.parser")
-                if not items[i]["path"].endswith("/"):
-                    item_path = items[i]["path"] + "/"
-                else:
-                    item_path = items[i]["path"]
-
-                links = [link for link in soup.find_all("a")]
-                
-                recursive_links = [] # Empty the recursive links if multiple Collections updated
-                recursive_links = recursive_filecheck(page_url, links, recursive_links)
-                
-                item_links = [link.get("href") for link in recursive_links if link.get("href").endswith(media_types[item_media_type]['ext'])]
-                if len(item_links) > 0:
-                    for link in item_links:
-                        data_path = online_data_prefix + item_path + link
-                        stac_item = create_item(data_path, collection, data_dict, item_media_type, items[i]["label"])
-                        # If rio-stac does not get the geometry from the file, insert it from the database using geom transformed to a GeoJSON
-                        if stac_item.bbox == [-180.0,-90.0,180.0,90.0]:
-                            geojson = json.loads(items[i]["geojson"])
-                            stac_item.geometry = geojson
-                            stac_item.bbox = pystac.utils.geometry_to_bbox(geojson)
-
-            # If rio-stac does not get the geometry from the file, insert it from the database using geom transformed to a GeoJSON
-            if stac_item.bbox == [-180.0,-90.0,180.0,90.0]:
-                geojson = json.loads(items[i]["geojson"])
-                stac_item.geometry = geojson
-                stac_item.bbox = pystac.utils.geometry_to_bbox(geojson)
-
-        bounds = [GeometryCollection([shape(s.geometry) for s in collection.get_all_items()]).bounds]
-        start_times = [st.common_metadata.start_datetime for st in collection.get_all_items()]
-        end_times = [et.common_metadata.end_datetime for et in collection.get_all_items()]
-        temporal = [[min(start_times), max(end_times)]]
-        collection.extent.spatial = pystac.SpatialExtent(bounds)
-        collection.extent.temporal = pystac.TemporalExtent(temporal)
-
-    for dataset in netcdf_datasets:
-
-        data_dict = datasets[dataset]
-        stac_id = data_dict["stac_id"]
-
-        if selected_collections: 
-        # Run with selected datasets
-            if stac_id not in selected_collections:
-                continue
+        if selected_collections:
+            # Run with selected datasets
+            ordered_datasets = [dataset for dataset in ordered_datasets if datasets[dataset]["stac_id"] in selected_collections]
 
-        catalog_collection_ids = [collection.id for collection in catalog.get_collections()]
-
-        if stac_id in catalog_collection_ids:
-            collection = catalog.get_child(stac_id)
-            # If multiple coordinate systems, add them to the description
-            coord_pattern = r"Coordinate systems:\s*(.*?)\."
-            scale_pattern = r"Scale:\s*(.*?)\."
-
-            if data_dict["scale"] not in collection.extra_fields["scale"]:
-                match = re.search(scale_pattern, collection.description)
-                collection.description = collection.description.replace(match.group(1), f"{match.group(1)}, {data_dict['scale']}")
-                collection.extra_fields["scale"].append(data_dict["scale"])
-                # If multiple scales, remove scale from Title
-                collection.title = f"{data_dict['name_eng']} (Paituli)"
-
-            if data_dict["coord_sys"] not in collection.extra_fields["coord_sys"]:
-                match = re.search(coord_pattern, collection.description)
-                collection.description = collection.description.replace(match.group(1), f"{match.group(1)}, {data_dict['coord_sys']}")
-                collection.extra_fields["coord_sys"].append(data_dict["coord_sys"])
-        else:
-            collection = create_collection(catalog, data_dict)
-
-        with conn.cursor() as curs:
-
-            data = (dataset,)
-            query = "select data_id, label, path, geom , ST_AsGeoJSON(geom) from index_wgs84 where index_wgs84.data_id=(%s)"
-            curs.execute(query, data)
-            items = {}
-            for i,result in enumerate(curs):
-                items[i] = dict(zip(["data_id", "label", "path", "geom", "geojson"], result))
-
-        item_media_type = data_dict["format_eng"].split(",")[0]
-
-        for i in items:
-            
-            # Check if file path ends in a file or is the path marked with "*". Lastly if none match the filelinks are taken via Beautiful Soup
-            if items[i]["path"].endswith(media_types[item_media_type]['ext']):
-                data_path = online_data_prefix+items[i]["path"]
-                stac_item = create_item(data_path, collection, data_dict, item_media_type, items[i]["label"])
-            elif items[i]["path"].endswith(".*"):
-                data_path = online_data_prefix+items[i]["path"].replace("*", media_types[item_media_type]["ext"])
-                stac_item = create_item(data_path, collection, data_dict, item_media_type, items[i]["label"])
-            elif items[i]["path"].endswith("*"):
-                data_path = online_data_prefix+items[i]["path"].replace("*", f".{media_types[item_media_type]['ext']}")
-                stac_item = create_item(data_path, collection, data_dict, item_media_type, items[i]["label"])
-            else:
-                # Check folder contents with BeautifulSoup
-                page_url = online_data_prefix+items[i]["path"]
-                page = requests.get(page_url)
-                data = page.text
-                soup = BeautifulSoup(data, features="html.parser")
-                if not items[i]["path"].endswith("/"):
-                    item_path = items[i]["path"] + "/"
-                else:
-                    item_path = items[i]["path"]
-
-                links = [link for link in soup.find_all("a")]
-                
-                recursive_links = [] # Empty the recursive links if multiple Collections updated
-                recursive_links = recursive_filecheck(page_url, links, recursive_links)
-                
-                item_links = [link.get("href") for link in recursive_links if link.get("href").endswith(media_types[item_media_type]['ext'])]
-                if len(item_links) > 0:
-                    for link in item_links:
-                        data_path = online_data_prefix + item_path +link
-                        stac_item = create_item(data_path, collection, data_dict, item_media_type, items[i]["label"])
-                        # If rio-stac does not get the geometry from the file, insert it from the database using geom transformed to a GeoJSON
-                        if stac_item.bbox == [-180.0,-90.0,180.0,90.0]:
-                            geojson = json.loads(items[i]["geojson"])
-                            stac_item.geometry = geojson
-                            stac_item.bbox = pystac.utils.geometry_to_bbox(geojson)
-
-            # If rio-stac does not get the geometry from the file, insert it from the database using geom transformed to a GeoJSON
-            if stac_item.bbox == [-180.0,-90.0,180.0,90.0]:
-                geojson = json.loads(items[i]["geojson"])
-                stac_item.geometry = geojson
-                stac_item.bbox = pystac.utils.geometry_to_bbox(geojson)
-        
-        bounds = [GeometryCollection([shape(s.geometry) for s in collection.get_all_items()]).bounds]
-        start_times = [st.common_metadata.start_datetime for st in collection.get_all_items()]
-        end_times = [et.common_metadata.end_datetime for et in collection.get_all_items()]
-        temporal = [[min(start_times), max(end_times)]]
-        collection.extent.spatial = pystac.SpatialExtent(bounds)
-        collection.extent.temporal = pystac.TemporalExtent(temporal)
+        # The index rows of all the datasets are streamed with one query
+        for dataset, rows in stream_index_rows(conn, ordered_datasets):
+            ingest_dataset(catalog, datasets[dataset], rows, build, args.workers)
 
     # Add metadata assets for made collections
-    for collection in selected_collections:
+    made_collections = selected_collections or {datasets[dataset]["stac_id"] for dataset in datasets}
+    for collection in made_collections:
         collection_datasets = [datasets[col] for col in datasets if datasets[col]["stac_id"] == collection]
         made_collection = catalog.get_child(collection)
         assets_to_add = generate_metadata_links(collection_datasets)
         made_collection.assets = assets_to_add
 
-    conn.close()
-    catalog.normalize_and_save("Paituli", skip_unresolved=True)
\ No newline at end of file
+    close_db_pool()
+    close_listing_cache()
+    close_metadata_cache()
+    catalog.normalize_and_save("Paituli", skip_unresolved=True)
+
+    # The catalog is saved, so the journal is not needed anymore if all of its Items were restored and all the files were read
+    # If the journal has Items of collections that were not made in this run, it's kept for resuming them
+    # If some files could not be read, it's kept for retrying them with --resume and --retry_failed
+    build["journal"].close()
+    if build["journal_items"]:
+        print(f"! The journal has Items of collections not made in this run, keeping {journal_path}: {', '.join(build['journal_items'])}")
+        print("  Run again with --resume and these collections to restore them")
+    elif build["failed_files"]:
+        print(f"! Keeping {journal_path}, run again with --resume and --retry_failed to read the failed files again")
+    else:
+        os.remove(journal_path)
+
+    # The files that could not be read are left out of the catalog, they are listed here and the run is marked as failed
+    if build["failed_files"]:
+        print(f"! {len(build['failed_files'])} files could not be read:")
+        for failed in build["failed_files"]:
+            print(f" - {failed['collection']} {failed['path']}: {failed['error']}")
+        raise Exception(f"{len(build['failed_files'])} files could not be read")
@@ -1,5 +1,10 @@
+import os
+import sys
 import pytest
 
+# The tests of the utils modules import them from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 def pytest_addoption(parser):
     parser.addoption("--collection", action="store", default="", help="Collection ID")
     parser.addoption("--host", action="store", default="", help="Catalog host")
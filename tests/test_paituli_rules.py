@@ -0,0 +1,258 @@
+import os
+import re
+import time
+import datetime
+import pytest
+
+import utils.paituli
+from utils.paituli import generate_timestamps, generate_item_id, generate_item_frame
+
+NLS = "National Land Survey of Finland"
+
+# Dataset, path and label of a file for every rule of the timestamps and the Item IDs
+rule_cases = [
+    ({"stac_id": "nls_digital_elevation_model_2m_at_paituli", "year": "2008-2020", "org_eng": NLS}, "https://www.nic.funet.fi/index/geodata/mml/dem2m/2008_latest/M4/M4133A.tif", None),
+    ({"stac_id": "nls_topographic_map_42k_at_paituli", "year": "192x", "org_eng": NLS}, "https://www.nic.funet.fi/index/geodata/mml/karttalehti/42k/192x/a-12_3.png", "a12"),
+    ({"stac_id": "nls_old_maps_at_paituli", "year": "1900-1950", "org_eng": NLS}, "https://www.nic.funet.fi/index/geodata/mml/vanhat/k_3.png", "3034 (1932)"),
+    ({"stac_id": "nls_old_maps_at_paituli", "year": "1900-1950", "org_eng": NLS}, "https://www.nic.funet.fi/index/geodata/mml/vanhat/k_4.png", "3035 (-)"),
+    ({"stac_id": "nls_old_maps_at_paituli", "year": "1900-1950", "org_eng": "Other"}, "https://www.nic.funet.fi/index/geodata/mml/vanhat/k_5.png", "3036 (-)"),
+    ({"stac_id": "syke_land_use_at_paituli", "year": "2015", "org_eng": "SYKE"}, "https://www.nic.funet.fi/index/geodata/syke/maankaytto/Maankaytto-2015_K4.tif", None),
+    ({"stac_id": "syke_land_use_at_paituli", "year": "2015", "org_eng": "SYKE"}, "https://www.nic.funet.fi/index/geodata/syke/maankaytto/k4.tif", "2015"),
+    ({"stac_id": "syke_land_use_at_paituli", "year": "2015", "org_eng": "SYKE"}, "https://www.nic.funet.fi/index/geodata/syke/maankaytto/k4.tif", "k4.1"),
+    ({"stac_id": "syke_land_use_at_paituli", "year": "2015", "org_eng": "SYKE"}, "https://www.nic.funet.fi/index/geodata/syke/maankaytto/k4.tif", "k/4"),
+    ({"stac_id": "syke_ei_kkayria_at_paituli", "year": "2006", "org_eng": "SYKE"}, "https://www.nic.funet.fi/index/geodata/syke/ei_kkayria/2006/ei_kkayria.tif", None),
+    ({"stac_id": "luke_snow_load_on_trees_at_paituli", "year": "2010-2099", "org_eng": "LUKE"}, "https://www.nic.funet.fi/index/geodata/luke/snow/rcp45_snowload_20402069.tif", None),
+    ({"stac_id": "fmi_temperature_predictions_monthly_at_paituli", "year": "2010-2039 (monthly means)", "org_eng": "FMI"}, "https://www.nic.funet.fi/index/geodata/ilmatiede/tas_rcp45_2010_jan.tif", None),
+    ({"stac_id": "fmi_precipitation_predictions_at_paituli", "year": "2040-2069", "org_eng": "FMI"}, "https://www.nic.funet.fi/index/geodata/ilmatiede/prec_rcp85.tif", None),
+    ({"stac_id": "fmi_monthly_avg_temperature_at_paituli", "year": "1961-2020", "org_eng": "FMI"}, "https://www.nic.funet.fi/index/geodata/ilmatiede/tmean_202002.tif", None),
+    ({"stac_id": "fmi_monthly_precipitation_1km_at_paituli", "year": "1961-2020", "org_eng": "FMI"}, "https://www.nic.funet.fi/index/geodata/ilmatiede/prec_1km_196112.nc", None),
+    ({"stac_id": "syke_corine_at_paituli", "year": "2000-2018", "org_eng": "SYKE"}, "https://www.nic.funet.fi/index/geodata/syke/corine/2012/clc_fi20m.tif", None),
+    ({"stac_id": "syke_corine_2018_at_paituli", "year": "2000-2018", "org_eng": "SYKE"}, "https://www.nic.funet.fi/index/geodata/syke/corine/2018/clc_fi20m.tif", None),
+    ({"stac_id": "syke_corine_at_paituli", "year": "2000-2018", "org_eng": "SYKE"}, "https://www.nic.funet.fi/index/geodata/syke/corine/clc_fi20m.tif", None),
+    ({"stac_id": "hy_spectre_canopy_at_paituli", "year": "2017-2019", "org_eng": "HY"}, "https://www.nic.funet.fi/index/geodata/hy/spectre/2022/canopy.tif", None),
+    ({"stac_id": "nls_orthoimage_at_paituli", "year": "2010-2020", "org_eng": NLS}, "https://www.nic.funet.fi/index/geodata/mml/orto/2015/etrs89/kp2m/m4/v1/M4133.jp2", None),
+    ({"stac_id": "nls_orthoimage_at_paituli", "year": "2010-2020", "org_eng": NLS}, "https://www.nic.funet.fi/index/geodata/mml/orto/2015/etrs89/kp2m/m4/v1/M4133.jp2", "m4133"),
+    ({"stac_id": "nls_general_map_1milj_at_paituli", "year": "2000-2020", "org_eng": NLS}, "https://www.nic.funet.fi/index/geodata/mml/yleiskartat/2019/1milj/yk_1milj_1.png", None)
+]
+
+def resolve_file(path: str) -> tuple:
+
+    """
+        Stands in for utils.paituli.resolve_file, so the 2m DEM rule does not read the folder listings.
+    """
+
+    return path, "2020-06-01T12:30:00"
+
+@pytest.fixture(autouse=True)
+def local_resolve_file(monkeypatch):
+    monkeypatch.setattr(utils.paituli, "resolve_file", resolve_file)
+
+# The rules as they were before they were compiled per dataset, kept as the reference for the compiled rules
+
+def legacy_generate_timestamps(path: str, data_dict: dict, label: str | None) -> dict:
+
+    """
+    A bunch of different scenarios for timestamps:
+     - If dataset has only the latest data, get the modification time of the file from the folder listing
+     - If the database year has a span of multiple years, set the timespan accordingly
+     - If the dataset contains monthly data, get the year and month from filename
+     - Else, try to get the year from the full path of the file
+     - Lastly, if the path does not contain the year, take the last year from the database year-field
+    """
+
+    year_pattern = r'(19\d{2}(?![\d_])|20\d{2}(?![\d_])|21\d{2}(?![\d_]))(-(?=\d{4}))?'
+    number_pattern = r'^\d+$'
+    label_pattern = r'(?<=\()18\d{2}(?=\))|(?<=\()19\d{2}(?=\))|(?<=\()20\d{2}(?=\))'
+    
+    # National Land Survey of Finland old maps has the year in the label
+    if label:
+        check_label = re.search(label_pattern, label)
+    else:
+        check_label = None
+
+    if "nls_digital_elevation_model_2m" in data_dict['stac_id']: # This gets the time for 2m DEM, there's no better alternative
+        modified = resolve_file(path)[1]
+        item_starttime = datetime.datetime.fromisoformat(modified)
+        item_endtime = datetime.datetime.fromisoformat(modified)
+        item_date = item_starttime.year
+    elif "nls_topographic_map_42k" in data_dict['stac_id'] and "x" in data_dict['year']: #Some datasets have years as 192x
+        item_starttime = datetime.datetime.strptime(f"1920-01-01 00:00:00", "%Y-%m-%d %H:%M:%S")
+        item_endtime = datetime.datetime.strptime(f"1930-12-31 00:00:00", "%Y-%m-%d %H:%M:%S")
+        item_date = f"{item_starttime.year}_{item_endtime.year}"
+    elif check_label: # If year in label, use that
+        label_year = check_label.group(0)
+        item_starttime = datetime.datetime.strptime(f"{label_year}-01-01 00:00:00", "%Y-%m-%d %H:%M:%S")
+        item_endtime = datetime.datetime.strptime(f"{label_year}-12-31 00:00:00", "%Y-%m-%d %H:%M:%S")
+        item_date = label_year
+    elif label and "(-)" in label and data_dict["org_eng"] == "National Land Survey of Finland": # If label year is blank, the year is unknown
+        split_year = data_dict["year"].split("-")
+        item_starttime = datetime.datetime.strptime(f"{split_year[0]}-01-01 00:00:00", "%Y-%m-%d %H:%M:%S")
+        item_endtime = datetime.datetime.strptime(f"{split_year[1]}-12-31 00:00:00", "%Y-%m-%d %H:%M:%S")
+        item_date = f"{split_year[0]}_{split_year[1]}"
+    elif "-" not in data_dict["year"]: # If only one year in dataset, use that
+        item_starttime = datetime.datetime.strptime(f"{data_dict['year']}-01-01 00:00:00", "%Y-%m-%d %H:%M:%S")
+        item_endtime = datetime.datetime.strptime(f"{data_dict['year']}-12-31 00:00:00", "%Y-%m-%d %H:%M:%S")
+        item_date = data_dict["year"]
+    elif "snow_load_on_trees" in data_dict["stac_id"]: # filename is type rcp**{startyear}{endyear}
+        split_file = path.split("/")[-1].split(".")[0]
+        start_year = split_file[-8:-4]
+        end_year = split_file[-4:]
+        item_starttime = datetime.datetime.strptime(f"{start_year}-01-01 00:00:00", "%Y-%m-%d %H:%M:%S")
+        item_endtime = datetime.datetime.strptime(f"{end_year}-12-31 00:00:00", "%Y-%m-%d %H:%M:%S")
+        item_date = f"{start_year}_{end_year}"
+    elif "predictions" in data_dict["stac_id"]:
+        # There are some datasets with parantheses in the years column
+        if len(data_dict['year'].split('(')) > 1: # Monthly mean precipitation and temperature predictions
+            split_fix = data_dict['year'].split('(')[0].strip()
+            split_years = split_fix.split('-')
+        else:
+            split_years = data_dict['year'].split('-')
+        item_starttime = datetime.datetime.strptime(f"{split_years[0]}-01-01 00:00:00", "%Y-%m-%d %H:%M:%S")
+        item_endtime = datetime.datetime.strptime(f"{split_years[1]}-12-31 00:00:00", "%Y-%m-%d %H:%M:%S")
+        item_date = f"{split_years[0]}_{split_years[1]}"
+    elif "monthly_avg" in data_dict["stac_id"] or "monthly_precipitation_1km" in data_dict["stac_id"]:
+        split_file = path.split("/")[-1].split(".")[0].split("_")
+        for split in split_file:
+            match = re.search(number_pattern, split)
+            if match:
+                numbers = match.group(0)
+                item_starttime = datetime.datetime.strptime(f"{numbers}-01", "%Y%m-%d")
+                # Calculate the last day of the corresponding month
+                first_day_of_next_month = item_starttime + datetime.timedelta(days=32)
+                lastday = first_day_of_next_month - datetime.timedelta(days=first_day_of_next_month.day)
+                item_endtime = datetime.datetime.strptime(f"{numbers}-{lastday.day}", "%Y%m-%d")
+                item_date = numbers
+    else:
+        match = re.search(year_pattern, path)
+        # Some HY SPECTRE data items have the publication date in the path and not the data date
+        if match and not data_dict['stac_id'].startswith("hy_spectre"):
+            if match.group(1) not in data_dict['stac_id']:
+                year = match.group(1)
+                item_starttime = datetime.datetime.strptime(f"{year}-01-01 00:00:00", "%Y-%m-%d %H:%M:%S")
+                item_endtime = datetime.datetime.strptime(f"{year}-12-31 00:00:00", "%Y-%m-%d %H:%M:%S")
+                item_date = year
+            else:
+                split_year = data_dict["year"].split("-")
+                item_starttime = datetime.datetime.strptime(f"{split_year[0]}-01-01 00:00:00", "%Y-%m-%d %H:%M:%S")
+                item_endtime = datetime.datetime.strptime(f"{split_year[1]}-12-31 00:00:00", "%Y-%m-%d %H:%M:%S")
+                item_date = f"{split_year[0]}_{split_year[1]}"
+        else:
+            split_year = data_dict["year"].split("-")
+            item_starttime = datetime.datetime.strptime(f"{split_year[0]}-01-01 00:00:00", "%Y-%m-%d %H:%M:%S")
+            item_endtime = datetime.datetime.strptime(f"{split_year[1]}-12-31 00:00:00", "%Y-%m-%d %H:%M:%S")
+            item_date = f"{split_year[0]}_{split_year[1]}"
+
+    item_timestamps = {
+        "item_start_time": item_starttime,
+        "item_end_time": item_endtime,
+        "item_date": item_date
+    }
+
+    return item_timestamps
+
+def legacy_generate_item_id(path: str, data_dict: dict, item_date: str, label: str | None) -> str:
+
+    """
+        Generate the Item IDs from the given information. 
+        This was done mainly through trial and error when any given dataset was widely different from previous ones.
+        If new datasets give wrong or similar IDs for different items, feel free to add new rules
+    """
+
+    # This specific dataset has an incomplete filepath in the dataset
+    if "ei_kkayria" in path and item_date == "2006":
+        split_path = path.split(".")
+        path = ".".join(split_path[:-1]) + "_RK2_2.tif"
+
+    if label:
+        if label == item_date:
+            item_id = f"{data_dict['stac_id']}_{label}"
+        else:
+            item_id = f"{data_dict['stac_id']}_{label}_{item_date}"
+    else:
+        item_name = path.split("/")[-1].split(".")[0].split("_")[0].lower()
+        item_name = item_name.replace("-", "_")
+        item_id = f"{data_dict['stac_id']}_{item_name}_{item_date}"
+
+    # For orthoimages, construct a different ID, which includes the dataset, elevation model, and the version number
+    if "orthoimage" in data_dict['stac_id']:
+        if label:
+            item_id = f"{data_dict['stac_id']}_{label}_{item_date}_{path.split('/')[-6]}_{path.split('/')[-3]}_{path.split('/')[-2]}"
+        else:
+            leaf = path.split("/")[-1].split(".")[0]
+            item_id = f"{data_dict['stac_id']}_{leaf}_{item_date}_{path.split('/')[-6]}_{path.split('/')[-3]}_{path.split('/')[-2]}"
+    elif "general_map" in data_dict['stac_id']:
+        split = path.split(".")[-2].split("_")
+        item_name = "".join(split)
+        item_id = f"{data_dict['stac_id']}_{item_name}_{item_date}"
+    elif "predictions" in data_dict["stac_id"] and "monthly" in data_dict["stac_id"]:
+        split = path.split("/")[-1].split(".")[-2].split("_")
+        item_name = "_".join(split[0:3])
+        item_id = f"{data_dict['stac_id']}_{item_name}_{item_date}"
+    elif data_dict["stac_id"].startswith("hy"):
+        item_id = f"{data_dict['stac_id']}_{item_date}"
+    elif "nls_topographic_map_42k" in data_dict['stac_id'] and "x" in data_dict['year']:
+        item_name = path.split("/")[-1].split(".")[0].split("_")[0].lower()
+        item_name = item_name.replace("-", "_")
+        item_id = f"{data_dict['stac_id']}_{item_name}_{item_date}"
+
+    # Some IDs have periods in them, remove them
+    if "." in item_id:
+        item_id = item_id.replace(".", "")
+    # Something fishy going with label having / in it even though it doesn't show up in database
+    elif "/" in item_id:
+        split = item_id.split("_")
+        label_split = split[-2]
+        fix = label_split.split("/")[-1]
+        item_id = item_id.replace(label_split, fix)
+
+    return item_id
+
+@pytest.mark.parametrize("data_dict, path, label", rule_cases)
+def test_rules_match_legacy(data_dict, path, label) -> None:
+
+    timestamps = generate_timestamps(path, data_dict, label)
+    legacy_timestamps = legacy_generate_timestamps(path, data_dict, label)
+    assert timestamps == legacy_timestamps
+
+    item_id = generate_item_id(path, data_dict, timestamps["item_date"], label)
+    assert item_id == legacy_generate_item_id(path, data_dict, legacy_timestamps["item_date"], label)
+
+def test_item_frame() -> None:
+
+    for data_dict, path, label in rule_cases:
+        item_frame = generate_item_frame([path, path], [label, label], data_dict)
+        timestamps = generate_timestamps(path, data_dict, label)
+
+        assert item_frame.loc[0, "item_start_time"] == timestamps["item_start_time"]
+        assert item_frame.loc[0, "item_end_time"] == timestamps["item_end_time"]
+        assert item_frame.loc[0, "item_date"] == timestamps["item_date"]
+        assert item_frame.loc[0, "item_id"] == generate_item_id(path, data_dict, timestamps["item_date"], label)
+        assert item_frame["duplicate"].all()
+
+    data_dict, path, label = rule_cases[5]
+    item_frame = generate_item_frame([path, path.replace("Maankaytto", "Metsa")], [label, label], data_dict)
+    assert not item_frame["duplicate"].any()
+    assert item_frame[~item_frame["item_id"].isin({item_frame.loc[0, "item_id"]})]["path"].tolist() == [path.replace("Maankaytto", "Metsa")]
+
+# The timing depends on the load of the machine, so the benchmark is run only when asked
+@pytest.mark.skipif(not os.environ.get("PAITULI_BENCHMARK"), reason="Set PAITULI_BENCHMARK=1 to run the benchmark")
+def test_rules_benchmark() -> None:
+
+    rounds = 500
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for data_dict, path, label in rule_cases:
+            timestamps = legacy_generate_timestamps(path, data_dict, label)
+            legacy_generate_item_id(path, data_dict, timestamps["item_date"], label)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for data_dict, path, label in rule_cases:
+            timestamps = generate_timestamps(path, data_dict, label)
+            generate_item_id(path, data_dict, timestamps["item_date"], label)
+    compiled_time = time.perf_counter() - start
+
+    # The compiled rules are several times faster, the margin leaves room for a noisy machine
+    assert compiled_time < legacy_time * 0.75
@@ -14,6 +14,8 @@ from pystac.extensions.eo import EOExtension
 from pystac.extensions.projection import ProjectionExtension
 
 from utils.json_convert import convert_json_to_geoserver
+from utils.stac_api import log_headers
+from utils.state_store import open_state_store, close_state_store, record_published, get_collection_item_ids
 from utils.allas_sentinel import get_sentinel2_bands, init_client, get_buckets, transform_crs, get_crs, get_metadata_content, get_metadata_from_xml
 
 def make_item(uri, metadatacontent, crs_metadata):
@@ -155,8 +157,7 @@ def update_catalog(app_host, csc_collection):
     buckets = get_buckets(s3_client)
     session = requests.Session()
     session.auth = ("admin", pwd)
-    log_headers = {"User-Agent": "update-script"} # Added for easy log-filtering
-    original_csc_collection_ids = {item.id for item in csc_collection.get_all_items()}
+    original_csc_collection_ids = get_collection_item_ids(csc_collection, args.reconcile)
     print(" * CSC Items collected.")
     items_to_add = {}
 
@@ -226,6 +227,7 @@ def update_catalog(app_host, csc_collection):
         request_point = f"collections/{csc_collection.id}/products"
         r = session.post(urljoin(app_host, request_point), headers=log_headers, json=converted_item)
         r.raise_for_status()
+        record_published(csc_collection.id, item, next(iter(items_to_add[item].assets.values())).href, converted_item)
     
     if items_to_add:
         print(f" + Number of items added: {len(items_to_add)}")
@@ -254,6 +256,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--host", type=str, help="Hostname of the selected STAC API", required=True)
     parser.add_argument("--profile", type=str, help="AWS profile to be used.")
+    parser.add_argument("--reconcile", action="store_true", help="Fetch the Item IDs from the STAC API and update the local state store with them")
 
     args = parser.parse_args()
 
@@ -270,7 +273,9 @@ if __name__ == "__main__":
     csc_catalog = pystac_client.Client.open(f"{args.host}/geoserver/ogc/stac/v1/", headers={"User-Agent":"update-script"})
     csc_collection = csc_catalog.get_collection("sentinel2-l2a")
     print(f"Updating STAC Catalog at {args.host}")
+    open_state_store(args.host)
     update_catalog(app_host, csc_collection)
+    close_state_store()
 
     end = time.time()
     print(f"Script took {end-start:.2f} seconds")
\ No newline at end of file
@@ -1,17 +1,17 @@
 import argparse
-import urllib
 import getpass
 import requests
 import pystac_client
 import pandas as pd
-import rasterio
 import time
-import json
 from urllib.parse import urljoin
-from pystac import Collection, Item
 
 from utils.json_convert import convert_json_to_geoserver
+from utils.stac_api import log_headers
 from utils.retry_errors import retry_errors
+from utils.fmi import create_fetch_session, fetch_items, fetch_item, fetch_collections, get_link_item_id, add_raster_metadata
+from utils.raster_metadata import open_metadata_cache, close_metadata_cache
+from utils.state_store import open_state_store, close_state_store, record_published, get_collection_item_ids, get_source_link_ids, record_source_links
 
 def update_catalog(app_host, csc_catalog_client):
 
@@ -24,7 +24,9 @@ def update_catalog(app_host, csc_catalog_client):
     
     session = requests.Session()
     session.auth = ("admin", pwd)
-    log_headers = {"User-Agent": "update-script"} # Added for easy log-filtering
+    fetch_session = create_fetch_session(args.workers)
+    failed_items = []
+    unreadable_items = []
 
     # Get all FMI collections from the app_host excluding the skipped collections
     # The new SYKE collections are picked up by this update logic, but additional logic is needed to fetch new Items for those Collections
@@ -33,93 +35,73 @@ def update_catalog(app_host, csc_catalog_client):
     if collections_to_skip:
         print(f"! Skipping {", ".join(collections_to_skip)}")
 
-    for collection in csc_collections:
+    # The FMI Collections are downloaded once and the known errors in their JSON, like the wrongly configured Temporal Extents, are fixed before reading them
+    derived_from = [next(link.target for link in collection.links if link.rel == "derived_from") for collection in csc_collections]
+    fmi_collections = fetch_collections(derived_from, args.workers, args.timeout, fetch_session)
 
-        derived_from = [link.target for link in collection.links if link.rel == "derived_from"]
-
-        # Some collections have wrongly configured Temporal Extents
-        try:
-            fmi_collection = Collection.from_file(derived_from[0])
-        except ValueError:
-            with urllib.request.urlopen(derived_from[0]) as url:
-                data = json.load(url)
-                data["extent"]["temporal"]["interval"] = [data["extent"]["temporal"]["interval"]]
-                fmi_collection = Collection.from_dict(data)
+    for collection, fmi_collection in zip(csc_collections, fmi_collections):
 
         fmi_collection.id = collection.id
         print(f"# Checking collection {collection.id}:")
-        fmi_collection_links = fmi_collection.get_child_links()
-
-        sub_collections = []
-        for link in fmi_collection_links:
-
-            # Some collections have wrongly configured Temporal Extents
-            try:
-                sub_collections.append(Collection.from_file(link.target))
-            except ValueError:
-                with urllib.request.urlopen(link.target) as url:
-                    data = json.load(url)
-                    data["extent"]["temporal"]["interval"] = [data["extent"]["temporal"]["interval"]]
-                    sub_collections.append(Collection.from_dict(data))
-            except Exception:
-                raise Exception(f"Child Collection link is broken in {collection.id} {link.target}")
-
-        item_links = list(set([link.target for sub in sub_collections for link in sub.get_item_links()]))
-        csc_item_ids = {item.id for item in collection.get_items()}
-
-        items = []
-        errors = []
-        for item in item_links:
-            try:
-                items.append(Item.from_file(item))
-            except Exception as e:
-                print(f" ! {e} on {item}")
-                errors.append(item)
+
+        try:
+            sub_collections = fetch_collections([link.get_absolute_href() for link in fmi_collection.get_child_links()], args.workers, args.timeout, fetch_session)
+        except Exception as e:
+            raise Exception(f"Child Collection link is broken in {collection.id}: {e}")
+
+        item_links = list(set([link.get_absolute_href() for sub in sub_collections for link in sub.get_item_links()]))
+        csc_item_ids = get_collection_item_ids(collection, args.reconcile)
+
+        # The IDs of the links are taken from the earlier runs or from the file names, so only the links of the new items are downloaded
+        if args.fetch_all:
+            new_links = item_links
+        else:
+            link_ids = get_source_link_ids(collection.id)
+            new_links = [link for link in item_links if link_ids.get(link, get_link_item_id(link)) not in csc_item_ids]
+            print(f" * Links to download: {len(new_links)}/{len(item_links)}")
+
+        items, errors = fetch_items(new_links, args.workers, args.timeout, fetch_session)
 
         # If there were connection errors during the item making process, the item generation for errors is retried
+        # The items that could not be retrieved after the retries are skipped, they are tried again on the next run
         if len(errors) > 0:
-            retry_errors(items, errors)
-            print(" * All errors fixed")
+            dead_letters = retry_errors(items, errors, fetch=lambda link: fetch_item(fetch_session, link, args.timeout), workers=args.workers)
+            if dead_letters:
+                print(f" ! Skipping {len(dead_letters)} items that could not be retrieved")
+                failed_items.extend(dead_letters)
+            else:
+                print(" * All errors fixed")
         
-        print(f" * Number of items in CSC STAC and FMI: {len(csc_item_ids)}/{len(items)}")
-
-        for item in items:
-            if item.id not in csc_item_ids:
-                fmi_collection.add_item(item)
-
-                with rasterio.open(next(iter(item.assets.values())).href) as src:
-                    item.extra_fields["gsd"] = src.res[0]
-                    # 9391 EPSG code is false, replace by the standard 3067
-                    if src.crs.to_epsg() == 9391:
-                        item.properties["proj:epsg"] = 3067
-                    else:
-                        item.properties["proj:epsg"] = src.crs.to_epsg()
-                    item.properties["proj:transform"] = [
-                        src.transform.a,
-                        src.transform.b,
-                        src.transform.c,
-                        src.transform.d,
-                        src.transform.e,
-                        src.transform.f,
-                        src.transform.g,
-                        src.transform.h,
-                        src.transform.i
-                    ]
-
-                for asset in item.assets:
-                    if item.assets[asset].roles is not list:
-                        item.assets[asset].roles = [item.assets[asset].roles]
+        record_source_links(collection.id, {item.get_self_href(): item.id for item in items})
+        print(f" * Number of items in CSC STAC and FMI: {len(csc_item_ids)}/{len(item_links)}")
+
+        new_items = [item for item in items if item.id not in csc_item_ids]
+
+        # The items whose file can't be read are skipped, they are tried again on the next run
+        unreadable = add_raster_metadata(new_items, args.workers)
+        unreadable_ids = {failed["item"].id for failed in unreadable}
+        for failed in unreadable:
+            print(f" ! Could not read {failed['href']} of {failed['item'].id}: {failed['error']}")
+        unreadable_items.extend(unreadable)
+
+        for item in (item for item in new_items if item.id not in unreadable_ids):
+            fmi_collection.add_item(item)
+
+            for asset in item.assets:
+                if item.assets[asset].roles is not list:
+                    item.assets[asset].roles = [item.assets[asset].roles]
     
-                del item.extra_fields["license"]
-                item.remove_links("license")
+            del item.extra_fields["license"]
+            item.remove_links("license")
 
-                item_dict = item.to_dict()
-                converted_item = convert_json_to_geoserver(item_dict)
-                request_point = f"collections/{collection.id}/products"
-                r = session.post(urljoin(app_host, request_point), headers=log_headers, json=converted_item)
-                r.raise_for_status()
+            item_dict = item.to_dict()
+            converted_item = convert_json_to_geoserver(item_dict)
+            request_point = f"collections/{collection.id}/products"
+            r = session.post(urljoin(app_host, request_point), headers=log_headers, json=converted_item)
+            r.raise_for_status()
+            record_published(collection.id, item.id, next(iter(item.assets.values())).href, converted_item)
 
-                print(f" + Added item {item.id}")
+            print(f" + Added item {item.id}")
 
         print(f" * All items present")
 
@@ -132,6 +114,16 @@ def update_catalog(app_host, csc_catalog_client):
         r = session.put(urljoin(app_host, request_point), headers=log_headers, json=converted_collection)
         r.raise_for_status()
         print(f" * Updated collection")
+
+    # The items that could not be retrieved don't stop the update, they are listed here and tried again on the next run
+    if failed_items:
+        print(f"! {len(failed_items)} FMI items could not be retrieved:")
+        for failed in failed_items:
+            print(f" - {failed['link']} after {failed['attempts']} retries: {failed['error']}")
+    if unreadable_items:
+        print(f"! {len(unreadable_items)} FMI items were skipped because their file could not be read:")
+        for failed in unreadable_items:
+            print(f" - {failed['item'].id} {failed['href']}: {failed['error']}")
     
 if __name__ == "__main__":
 
@@ -143,6 +135,11 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--host", type=str, help="Hostname of the selected STAC API", required=True)
     parser.add_argument("--skip", nargs="+", help="Skips the given collection IDs")
+    parser.add_argument("--reconcile", action="store_true", help="Fetch the Item IDs from the STAC API and update the local state store with them")
+    parser.add_argument("--workers", type=int, default=8, help="Number of FMI Items downloaded at the same time")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for each FMI Item download")
+    parser.add_argument("--fetch_all", action="store_true", help="Download all the FMI Items instead of only the links of the Items not in the catalog")
+    parser.add_argument("--no_cache", action="store_true", help="Read the raster headers from the files instead of the local cache")
     
     args = parser.parse_args()
     collections_to_skip = args.skip if args.skip else []
@@ -159,7 +156,12 @@ if __name__ == "__main__":
     csc_catalog_client = pystac_client.Client.open(f"{args.host}/geoserver/ogc/stac/v1/", headers={"User-Agent":"update-script"})
 
     print(f"Updating STAC Catalog at {args.host}")
+    if not args.no_cache:
+        open_metadata_cache()
+    open_state_store(args.host)
     update_catalog(app_host, csc_catalog_client)
+    close_state_store()
+    close_metadata_cache()
 
     end = time.time()
     print(f"Script took {end-start:.2f} seconds")
\ No newline at end of file
@@ -13,7 +13,9 @@ from rio_stac.stac import create_stac_item
 from urllib.parse import urljoin
 
 from utils.json_convert import convert_json_to_geoserver
+from utils.stac_api import log_headers
 from utils.geocubes_api import get_datasets
+from utils.state_store import open_state_store, close_state_store, record_published, get_collection_item_ids
 
 def update_catalog(app_host, csc_catalog_client):
 
@@ -26,7 +28,6 @@ def update_catalog(app_host, csc_catalog_client):
     title_regex_pattern = r" \(GeoCubes\)"
     session = requests.Session()
     session.auth = ("admin", pwd)
-    log_headers = {"User-Agent": "update-script"} # Added for easy log-filtering
 
     # Get all Geocubes collections from the app_host
     csc_collections = [col for col in csc_catalog_client.get_collections() if col.id.endswith("at_geocubes")]
@@ -49,7 +50,7 @@ def update_catalog(app_host, csc_catalog_client):
 
         collection_id = titles_and_ids[translated_name]
         csc_collection = csc_catalog_client.get_child(collection_id)
-        csc_collection_item_ids = [item.id for item in csc_collection.get_items()]
+        csc_collection_item_ids = get_collection_item_ids(csc_collection, args.reconcile)
 
         paths = geocubes_datasets[dataset]['paths']
         print(f"Checking new items for {csc_collection.id}: ", end="")
@@ -173,6 +174,7 @@ def update_catalog(app_host, csc_catalog_client):
                     request_point = f"collections/{csc_collection.id}/products"
                     r = session.post(urljoin(app_host, request_point), headers=log_headers, json=converted_item)
                     r.raise_for_status()
+                    record_published(csc_collection.id, item.id, item.assets["COG"].href, converted_item)
 
         print(f"{len(csc_collection_item_ids)}/{number_of_items_in_geocubes}")
         if number_of_items_added:
@@ -199,6 +201,7 @@ if __name__ == "__main__":
     pw_filename = '../passwords.txt'
     parser = argparse.ArgumentParser()
     parser.add_argument("--host", type=str, help="Hostname of the selected STAC API", required=True)
+    parser.add_argument("--reconcile", action="store_true", help="Fetch the Item IDs from the STAC API and update the local state store with them")
     
     args = parser.parse_args()
 
@@ -215,7 +218,9 @@ if __name__ == "__main__":
     csc_catalog_client = pystac_client.Client.open(f"{args.host}/geoserver/ogc/stac/v1/", headers={"User-Agent":"update-script"})
 
     print(f"Updating STAC Catalog at {args.host}")
+    open_state_store(args.host)
     update_catalog(app_host, csc_catalog_client)
+    close_state_store()
 
     end = time.time()
     print(f"Script took {end-start:.2f} seconds")
\ No newline at end of file
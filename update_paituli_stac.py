@@ -1,111 +1,48 @@
 import pystac
-import psycopg2
-import rasterio
-import requests
 import getpass
 import argparse
 import re
-import os
 import json
 import time
 import pystac_client
+import requests
 import pandas as pd
-from rio_stac.stac import create_stac_item
-from bs4 import BeautifulSoup
 from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from utils.json_convert import convert_json_to_geoserver
-from utils.paituli import recursive_filecheck, get_new_local_files, generate_timestamps, generate_item_id, generate_metadata_links
+from utils.paituli_db import open_db_pool, close_db_pool, db_connection, select_datasets, stream_index_rows, get_dataset_directories, get_dataset_fingerprints
+from utils.state_store import open_state_store, close_state_store, record_published, get_collection_item_ids, get_recorded_fingerprints, record_dataset_fingerprint
+from utils.geoserver_upload import create_upload_session, start_uploads, queue_upload, wait_uploads, finish_uploads
+from utils.stac_api import log_headers
+from utils.listing_cache import open_listing_cache, close_listing_cache
+from utils.local_manifest import open_local_manifest, close_local_manifest, save_local_manifest
+from utils.raster_metadata import open_metadata_cache, close_metadata_cache, read_raster_metadata, create_item_from_metadata
+from utils.paituli import list_directory_files, get_new_local_files, generate_item_frame, generate_metadata_links, create_data_asset, get_item_epsg, resolve_file, get_dataset_roots
 
-def create_item(path: str, data_dict: dict, item_media_type: str, label: str | None) -> pystac.Item:
+def create_item(path: str, data_dict: dict, item_media_type: str, item_id: str, item_start_time: str, item_end_time: str) -> pystac.Item:
 
     """
         path - String of the URL where the file is located
         data_dict - Dictionary of the dataset from the Postgresql DB
         item_media_type - String of the media type the file is in
-        label - String of the label given in the index_wgs84
+        item_id - ID of the Item from generate_item_frame
+        item_start_time, item_end_time - Start and end times of the Item from generate_item_frame
 
         -> pystac.Item
     """
 
-    # If create_item is called, flip flag to True
-    global added_items_flag
-    added_items_flag = True
-
-    item_timestamps = generate_timestamps(path, data_dict, label)
-
-    item_id = generate_item_id(path, data_dict, item_timestamps["item_date"], label)
-
     # There are files which have case-sensitive file-extensions
-    # If the default extension returns 404, switch it to uppercase
-    r = requests.head(path)
-    if r.status_code == 404:
-        address = os.path.dirname(path)
-        filename = os.path.basename(path)
-        current_extension = os.path.splitext(filename)[1]
-        new_filename = os.path.splitext(filename)[0] + current_extension.upper()
-        path = os.path.join(address, new_filename)
+    # The right extension and the modification time are taken from the folder listing
+    path, last_modified = resolve_file(path)
 
     asset_id = f"{data_dict['stac_id']}_{item_media_type.lower()}"
 
-    with rasterio.open(path) as src:
-        asset = pystac.Asset(
-            href = path, 
-            media_type = media_types[item_media_type]["mime"], 
-            title = asset_id,
-            roles = ["data"],
-            extra_fields = {
-                "gsd": float(src.res[0]),
-                "proj:shape": src.shape,
-                "proj:transform": [
-                    src.transform.a,
-                    src.transform.b,
-                    src.transform.c,
-                    src.transform.d,
-                    src.transform.e,
-                    src.transform.f,
-                    src.transform.g,
-                    src.transform.h,
-                    src.transform.i
-                ]
-            }
-        )
-        if item_media_type != "NetCDF":
-            if src.crs:
-                item_epsg = src.crs.to_epsg(confidence_threshold=50)
-            else:
-                if data_dict["coord_sys"] == "ETRS-TM35FIN" or data_dict["coord_sys"] == "WGS84/ETRS-TM35FIN":
-                    item_epsg = 3067
-                else:
-                    kkj_codes = {
-                            "kkj": 4123,
-                            "kkj0": 3386,
-                            "kkj1": 2391,
-                            "kkj2": 2392,
-                            "kkj3": 2393,
-                            "kkj4": 2394,
-                            "kkj5": 3387
-                        }
-                    if "compress95" in path:
-                        # Take the KKJ Zone from the path
-                        path_kkj = path.split("/")[-7]
-                        if path_kkj in kkj_codes:
-                            item_epsg = kkj_codes[path_kkj]
-                    elif "thematic_rasters" in data_dict["stac_id"]:
-                        item_epsg = kkj_codes["kkj3"]
-
-        else: # NetCDF datasets are in 3067
-            item_epsg = 3067
-
-    item = create_stac_item(
-        source = path,
-        id = item_id,
-        assets = {
-            asset_id : asset
-        },
-        asset_media_type = media_types[item_media_type]["mime"], 
-        with_proj = True
-    )
+    metadata = read_raster_metadata(path, last_modified)
+    asset = create_data_asset(path, metadata, asset_id, media_types[item_media_type]["mime"])
+    item_epsg = get_item_epsg(metadata["epsg"], path, data_dict, item_media_type)
+
+    item = create_item_from_metadata(metadata, item_id, {asset_id: asset})
     
     # If add_puhti argument given, add puhti asset
     if args.add_puhti:
@@ -115,13 +52,64 @@ def create_item(path: str, data_dict: dict, item_media_type: str, label: str | N
         item.add_asset(key=puhti_asset.title, asset=puhti_asset)
 
     item.extra_fields["gsd"] = item.assets[asset_id].extra_fields["gsd"]
-    item.common_metadata.start_datetime = item_timestamps["item_start_time"]
-    item.common_metadata.end_datetime = item_timestamps["item_end_time"]
+    item.common_metadata.start_datetime = item_start_time
+    item.common_metadata.end_datetime = item_end_time
     if item.properties["proj:epsg"] == None: item.properties["proj:epsg"] = item_epsg
     if item.properties["proj:epsg"] == 9391 or item.properties["proj:epsg"] == "EPSG:9391": item.properties["proj:epsg"] = 3067
 
     return item
 
+def get_candidate_files(rows, item_media_type: str, crawl_errors: list | None = None):
+
+    """
+        Yields the files of the index_wgs84 rows of a dataset as dictionaries with the URL, the label and the GeoJSON of the row.
+        If the path of a row does not include a file, the files are taken from the folder listings.
+
+        rows - Iterable of the index_wgs84 rows as dictionaries
+        item_media_type - String of the media type of the dataset
+        crawl_errors - Optional list where the folders that could not be listed are added. The other rows are still gone through.
+                       If not given, a failed listing raises
+    """
+
+    extension = media_types[item_media_type]["ext"]
+
+    for row in rows:
+
+        if len(row["label"].split("_")) > 1 or len(row["label"].split("(")) > 1 or len(row["label"].split(" ")) > 1:
+            label = None
+        else:
+            label = row["label"].lower()
+
+        # Check if file path ends in a file or is the path marked with "*". Lastly if none match, the filelinks are taken from the folder listings
+        if row["path"].endswith(extension):
+            data_paths = [online_data_prefix+row["path"]]
+        elif row["path"].endswith(".*"):
+            data_paths = [online_data_prefix+row["path"].replace("*", extension)]
+        elif row["path"].endswith("*"):
+            data_paths = [online_data_prefix+row["path"].replace("*", f".{extension}")]
+        else:
+            # Crawl the folder and its subfolders for the files
+            item_path = row["path"] if row["path"].endswith("/") else row["path"] + "/"
+            try:
+                listed_files = list_directory_files(online_data_prefix + item_path)
+            except Exception as e:
+                if crawl_errors is None:
+                    raise
+                crawl_errors.append({"path": item_path, "error": str(e)})
+                continue
+            data_paths = [online_data_prefix + item_path + link for link in listed_files if link.endswith(extension)]
+
+        for data_path in data_paths:
+            yield {"path": data_path, "label": label, "geojson": row["geojson"]}
+
+def record_upload(upload: dict) -> None:
+
+    """
+        Records an Item sent by the upload workers in the state store.
+    """
+
+    record_published(upload["collection_id"], upload["item_id"], upload["href"], upload["json"])
+
 def get_datasets(collections: list) -> dict:
 
     """
@@ -129,20 +117,15 @@ def get_datasets(collections: list) -> dict:
         Returns a dictionary of the datasets with the associated STAC Collection ID as the key.
     """
 
-    conn = psycopg2.connect(f"host={args.db_host} port={paituli_port} user=paituli-ro password={paituli_pwd} dbname=paituli")
-
-    with conn.cursor() as curs:
-            
-        data = (collections,)
-        query = "select data_id, stac_id, org_eng, name_eng, scale, year, format_eng, coord_sys, license_url, meta from dataset where access=1 and stac_id=ANY(%s)"
-        curs.execute(query, data)
-        datasets = {}
-        for result in curs:
-            new_dict = dict(zip(["data_id", "stac_id", "org_eng", "name_eng", "scale", "year", "format_eng", "coord_sys", "license_url", "metadata"], result))
-            if new_dict["stac_id"] not in datasets.keys(): 
-                datasets[new_dict["stac_id"]] = [{key: value for key, value in new_dict.items()}]
-            else:
-                datasets[new_dict["stac_id"]].append({key: value for key, value in new_dict.items()})
+    with db_connection() as conn:
+        results = select_datasets(conn, collections)
+
+    datasets = {}
+    for new_dict in results:
+        if new_dict["stac_id"] not in datasets.keys(): 
+            datasets[new_dict["stac_id"]] = [new_dict]
+        else:
+            datasets[new_dict["stac_id"]].append(new_dict)
 
     for collection in collections:
         if collection not in datasets:
@@ -150,237 +133,241 @@ def get_datasets(collections: list) -> dict:
     
     return datasets
 
-def update_catalog_collection(app_host: str, csc_catalog_client: pystac_client.Client, datasets: dict) -> None:
-
-    global added_items_flag
-
-    conn = psycopg2.connect(
-        host=args.db_host, 
-        port=paituli_port, 
-        user="paituli-ro", 
-        password=paituli_pwd, 
-        dbname="paituli",
-        keepalives=1,
-        keepalives_idle=30,
-        keepalives_interval=10,
-        keepalives_count=5
-    )
-    session = requests.Session()
-    session.auth = ("admin", geoserver_pwd)
-    log_headers = {"User-Agent": "update-script"} # Added for easy log-filtering
+def update_collection(app_host: str, csc_catalog_client: pystac_client.Client, stac_id: str, data_dicts: list, session: requests.Session, uploads: dict, local_files: set | None, dataset_changes: dict, crawl_failures: dict) -> None:
 
-    if args.local:
-        local_files = get_new_local_files()
-
-    for stac_id in datasets:
-
-        print(f"Checking {stac_id}:")
+    """
+        Updates one Collection. The Collections are updated in their own threads, so each borrows its own DB connection from the pool.
+        The Items are made in this thread and uploaded by the shared upload workers.
+
+        app_host - The REST API path for updating the collections
+        csc_catalog_client - The STAC API client for checking which items are already in the collections
+        stac_id - ID of the Collection
+        data_dicts - The datasets of the Collection
+        session - Session to the REST API
+        uploads - The upload pipeline, see start_uploads
+        local_files - The new local files if the local flag is given, see get_new_local_files
+        dataset_changes - Dictionary telling for each data_id the fingerprint of its index rows, whether the rows have changed
+                          since the last update and whether new local files were found for it
+        crawl_failures - Dictionary shared by the Collections, where the datasets whose folders could not all be listed are added
+    """
 
-        csc_collection = csc_catalog_client.get_collection(stac_id)
-        collection_item_ids = set(item.id for item in csc_collection.get_items())
+    print(f"Checking {stac_id}:")
 
-        # Check if the Collection contains NetCDF files and create a list for storing the added IDs
-        netcdf_present = False
-        for data_dict in datasets[stac_id]:
-            if data_dict["format_eng"] == "NetCDF":
-                netcdf_present = True
-                
-        for data_dict in datasets[stac_id]:
-            data_id = data_dict["data_id"]
+    # With the local flag, the datasets without changes in their index rows or local files are skipped
+    if args.local:
+        update_dicts = [data_dict for data_dict in data_dicts if dataset_changes[data_dict["data_id"]]["rows_changed"] or dataset_changes[data_dict["data_id"]]["local_changes"]]
+    else:
+        update_dicts = data_dicts
+
+    if not update_dicts and not args.update_extents:
+        print(f" - No changes for {stac_id}")
+        return
+
+    csc_collection = csc_catalog_client.get_collection(stac_id)
+    added_items = False
+
+    # Check if the Collection contains NetCDF files and create a list for storing the added IDs
+    netcdf_present = False
+    for data_dict in data_dicts:
+        if data_dict["format_eng"] == "NetCDF":
+            netcdf_present = True
+
+    # The Items of the Collection are fetched once. The map is used for checking which Items exist
+    # and for adding the assets of the other file formats to the NetCDF Items
+    # Without NetCDF files only the IDs are needed, so the full Items are not fetched
+    if netcdf_present:
+        remote_items = {item.id: item for item in csc_collection.get_items()}
+    else:
+        remote_items = dict.fromkeys(get_collection_item_ids(csc_collection, args.reconcile))
+    # IDs of the Items queued for upload, a second upload of the same Item waits until the first one has been sent
+    queued_item_ids = set()
 
-            with conn.cursor() as curs:
+    # The index rows of the datasets are streamed with one query in the same order as they are gone through below
+    with db_connection() as conn:
+        index_rows = stream_index_rows(conn, [data_dict["data_id"] for data_dict in update_dicts])
 
-                data = (data_id,)
-                query = "select gid, data_id, label, path, geom , ST_AsGeoJSON(geom) from index_wgs84 where index_wgs84.data_id=(%s)"
-                curs.execute(query, data)
-                items = []
-                for result in curs:
-                    items.append(dict(zip(["gid", "data_id", "label", "path", "geom", "geojson"], result)))
-            
+        for data_dict in update_dicts:
+            data_id, items = next(index_rows)
+        
             item_media_type = data_dict["format_eng"].split(",")[0]
-            
+        
             # If local flag given, get only the files that have been modified/downloaded recently
-            if args.local:
-                items = [x for x in items if x["path"].split(".")[0] in local_files]
-
-            for item in items:
-                
-                item_path = item["path"]
-                
-                if len(item["label"].split("_")) > 1 or len(item["label"].split("(")) > 1 or len(item["label"].split(" ")) > 1:
-                    label = None
-                else:
-                    label = item["label"].lower()
-
-                #If path does not include a file, the filelinks are taken via BeautifulSoup
-                if not item_path.endswith(media_types[item_media_type]['ext']) and not item_path.endswith(".*") and not item_path.endswith("*"):
-                    # Check folder contents with BeautifulSoup
-                    page_url = online_data_prefix+item_path
-                    page = requests.get(page_url)
-                    data = page.text
-                    soup = BeautifulSoup(data, features="html.parser")
-                    if not item_path.endswith("/"):
-                        item_path = item_path + "/"
-
-                    links = [link for link in soup.find_all("a")]
-
-                    recursive_links = [] # Empty the recursive links if multiple Collections updated
-                    recursive_links = recursive_filecheck(page_url, links, recursive_links)
-                    
-                    item_links = [link.get("href") for link in recursive_links if link.get("href").endswith(media_types[item_media_type]['ext'])]
-                    if len(item_links) > 0:
-                        for link in item_links:
-                            data_path = online_data_prefix + item_path + link
-                            item_timestamps = generate_timestamps(data_path, data_dict, label)
-                            stac_item_id = generate_item_id(data_path, data_dict, item_timestamps["item_date"], label)
-                            if not netcdf_present and stac_item_id in collection_item_ids:
-                                continue
-                            if netcdf_present and stac_item_id in [item.id for item in csc_collection.get_items()]:
-                                item_to_add_asset = csc_collection.get_item(stac_item_id)
-                                item_asset_extensions = [asset.split("_")[-1] for asset in item_to_add_asset.assets]
-                                if item_media_type.lower() in item_asset_extensions: #If asset already in item, skip
-                                    continue
-                                else:
-                                    asset_id = f"{data_dict['stac_id']}_{item_media_type.lower()}"
-                                    with rasterio.open(data_path) as src:
-                                        asset = pystac.Asset(
-                                            href = data_path, 
-                                            media_type = media_types[item_media_type]["mime"], 
-                                            title = asset_id,
-                                            roles = ["data"],
-                                            extra_fields = {
-                                                "gsd": float(src.res[0]),
-                                                "proj:shape": src.shape,
-                                                "proj:transform": [
-                                                    src.transform.a,
-                                                    src.transform.b,
-                                                    src.transform.c,
-                                                    src.transform.d,
-                                                    src.transform.e,
-                                                    src.transform.f,
-                                                    src.transform.g,
-                                                    src.transform.h,
-                                                    src.transform.i
-                                                ]
-                                            }
-                                        )
-                                    item_to_add_asset.add_asset(key=asset_id, asset=asset)
-                                    # If add_puhti argument given, add puhti assets
-                                    if args.add_puhti:
-                                        puhti_asset = asset.clone()
-                                        puhti_asset.href = re.sub(online_data_prefix, puhti_data_prefix, puhti_asset.href)
-                                        puhti_asset.title = re.sub("paituli", "puhti", puhti_asset.title)
-                                        item_to_add_asset.add_asset(key=puhti_asset.title, asset=puhti_asset)
-
-                                    item_dict = item_to_add_asset.to_dict()
-                                    converted_item = convert_json_to_geoserver(item_dict)
-                                    request_point = f"collections/{csc_collection.id}/products/{item_to_add_asset.id}"
-                                    r = session.put(urljoin(app_host, request_point), headers=log_headers, json=converted_item)
-                                    r.raise_for_status()
-                            else:
-                                stac_item = create_item(data_path, data_dict, item_media_type, label)
-                                print(f" + Added {stac_item_id}")
-
-                                # If rio-stac does not get the geometry from the file, insert it from the database using geom transformed to a GeoJSON
-                                if stac_item.bbox == [-180.0,-90.0,180.0,90.0]:
-                                    geojson = json.loads(item["geojson"])
-                                    stac_item.geometry = geojson
-                                    stac_item.bbox = pystac.utils.geometry_to_bbox(geojson)
-                                    
-                                csc_collection.add_item(stac_item)
-                                item_dict = stac_item.to_dict()
-                                converted_item = convert_json_to_geoserver(item_dict)
-                                request_point = f"collections/{csc_collection.id}/products"
-                                r = session.post(urljoin(app_host, request_point), headers=log_headers, json=converted_item)
-                                r.raise_for_status()
-                else:
-                    # Check if file path ends in a file or is the path marked with "*".
-                    if item_path.endswith(media_types[item_media_type]['ext']):
-                        data_path = online_data_prefix+item_path
-                    elif item_path.endswith(".*"):
-                        data_path = online_data_prefix+item_path.replace("*", media_types[item_media_type]["ext"])
-                    elif item_path.endswith("*"):
-                        data_path = online_data_prefix+item_path.replace("*", f".{media_types[item_media_type]['ext']}")
-                    item_timestamps = generate_timestamps(data_path, data_dict, label)
-                    stac_item_id = generate_item_id(data_path, data_dict, item_timestamps["item_date"], label)
-                    if not netcdf_present and stac_item_id in collection_item_ids:
+            # If the index rows of the dataset have changed, all the rows are checked
+            if args.local and not dataset_changes[data_id]["rows_changed"]:
+                items = (x for x in items if x["path"].split(".")[0] in local_files)
+
+            # The IDs of all the files of the dataset are made at once and checked against the Collection before any file is read
+            crawl_errors = []
+            files = list(get_candidate_files(items, item_media_type, crawl_errors))
+            # The dataset is not marked as updated if some of its folders could not be listed
+            if crawl_errors:
+                crawl_failures[data_id] = {"collection_id": stac_id, "errors": crawl_errors}
+                print(f" ! {len(crawl_errors)} folders of {data_id} could not be listed")
+            if not files:
+                continue
+            item_frame = generate_item_frame([file["path"] for file in files], [file["label"] for file in files], data_dict)
+            item_frame["geojson"] = [file["geojson"] for file in files]
+
+            duplicate_ids = item_frame.loc[item_frame["duplicate"], "item_id"].unique()
+            if len(duplicate_ids) > 0:
+                print(f" ! {len(duplicate_ids)} Item IDs are given to multiple files in {data_id}: {', '.join(duplicate_ids[:5])}")
+
+            # Without NetCDF files, the files of the Items already in the Collection are not needed
+            if not netcdf_present:
+                item_frame = item_frame[~item_frame["item_id"].isin(remote_items.keys())]
+
+            for file in item_frame.itertuples(index=False):
+
+                data_path = file.path
+                stac_item_id = file.item_id
+
+                if not netcdf_present and stac_item_id in remote_items:
+                    continue
+                elif netcdf_present and stac_item_id in remote_items:
+                    item_to_add_asset = remote_items[stac_item_id]
+                    item_asset_extensions = [asset.split("_")[-1] for asset in item_to_add_asset.assets]
+                    if item_media_type.lower() in item_asset_extensions: #If asset already in item, skip
                         continue
-                    elif netcdf_present and stac_item_id in [item.id for item in csc_collection.get_items()]:
-                        item_to_add_asset = csc_collection.get_item(stac_item_id)
-                        item_asset_extensions = [asset.split("_")[-1] for asset in item_to_add_asset.assets]
-                        if item_media_type.lower() in item_asset_extensions: #If asset already in item, skip
-                            continue
-                        else:
-                            asset_id = f"{data_dict['stac_id']}_{item_media_type.lower()}"
-                            with rasterio.open(data_path) as src:
-                                asset = pystac.Asset(
-                                    href = data_path, 
-                                    media_type = media_types[item_media_type]["mime"], 
-                                    title = asset_id,
-                                    roles = ["data"],
-                                    extra_fields = {
-                                        "gsd": float(src.res[0]),
-                                        "proj:shape": src.shape,
-                                        "proj:transform": [
-                                            src.transform.a,
-                                            src.transform.b,
-                                            src.transform.c,
-                                            src.transform.d,
-                                            src.transform.e,
-                                            src.transform.f,
-                                            src.transform.g,
-                                            src.transform.h,
-                                            src.transform.i
-                                        ]
-                                    }
-                                )
-                            item_to_add_asset.add_asset(key=asset_id, asset=asset)
-
-                            # If add_puhti argument given, add puhti assets
-                            if args.add_puhti:
-                                puhti_asset = asset.clone()
-                                puhti_asset.href = re.sub(online_data_prefix, puhti_data_prefix, puhti_asset.href)
-                                puhti_asset.title = re.sub("paituli", "puhti", puhti_asset.title)
-                                item_to_add_asset.add_asset(key=puhti_asset.title, asset=puhti_asset)
-
-                            item_dict = item_to_add_asset.to_dict()
-                            converted_item = convert_json_to_geoserver(item_dict)
-                            request_point = f"collections/{csc_collection.id}/products/{item_to_add_asset.id}"
-                            r = session.put(urljoin(app_host, request_point), headers=log_headers, json=converted_item)
-                            r.raise_for_status()
                     else:
-                        stac_item = create_item(data_path, data_dict, item_media_type, label)
-                        csc_collection.add_item(stac_item)
-                        print(f" + Added {stac_item_id}")
-
-                        # If rio-stac does not get the geometry from the file, insert it from the database using geom transformed to a GeoJSON
-                        if stac_item.bbox == [-180.0,-90.0,180.0,90.0]:
-                            geojson = json.loads(item["geojson"])
-                            stac_item.geometry = geojson
-                            stac_item.bbox = pystac.utils.geometry_to_bbox(geojson)
-                            
-                        item_dict = stac_item.to_dict()
+                        asset_id = f"{data_dict['stac_id']}_{item_media_type.lower()}"
+                        data_path, last_modified = resolve_file(data_path)
+                        metadata = read_raster_metadata(data_path, last_modified)
+                        asset = create_data_asset(data_path, metadata, asset_id, media_types[item_media_type]["mime"])
+                        item_to_add_asset.add_asset(key=asset_id, asset=asset)
+
+                        # If add_puhti argument given, add puhti assets
+                        if args.add_puhti:
+                            puhti_asset = asset.clone()
+                            puhti_asset.href = re.sub(online_data_prefix, puhti_data_prefix, puhti_asset.href)
+                            puhti_asset.title = re.sub("paituli", "puhti", puhti_asset.title)
+                            item_to_add_asset.add_asset(key=puhti_asset.title, asset=puhti_asset)
+
+                        item_dict = item_to_add_asset.to_dict()
                         converted_item = convert_json_to_geoserver(item_dict)
-                        request_point = f"collections/{csc_collection.id}/products"
-                        r = session.post(urljoin(app_host, request_point), headers=log_headers, json=converted_item)
-                        r.raise_for_status()
-
-        if added_items_flag or args.update_extents:
-            assets_to_add = generate_metadata_links(datasets[stac_id])
-            csc_collection.assets = assets_to_add
-            csc_collection.update_extent_from_items()
-            collection_dict = csc_collection.to_dict()
-            converted_collection = convert_json_to_geoserver(collection_dict)
-            request_point = f"collections/{csc_collection.id}/"
-
-            r = session.put(urljoin(app_host, request_point), headers=log_headers, json=converted_collection)
-            r.raise_for_status()
-            print(" + Updated collection extents.")
-        else:
-            print(f" - No new items for {csc_collection.id}")
-    
-    conn.close()
-        
+                        request_point = f"collections/{csc_collection.id}/products/{item_to_add_asset.id}"
+                        if item_to_add_asset.id in queued_item_ids:
+                            wait_uploads(uploads, csc_collection.id)
+                        queued_item_ids.add(item_to_add_asset.id)
+                        queue_upload(uploads, "PUT", request_point, converted_item, item_to_add_asset.id, csc_collection.id, data_path)
+                else:
+                    stac_item = create_item(data_path, data_dict, item_media_type, stac_item_id, file.item_start_time, file.item_end_time)
+                    added_items = True
+                    csc_collection.add_item(stac_item)
+                    print(f" + Added {stac_item_id}")
+
+                    # If rio-stac does not get the geometry from the file, insert it from the database using geom transformed to a GeoJSON
+                    if stac_item.bbox == [-180.0,-90.0,180.0,90.0]:
+                        geojson = json.loads(file.geojson)
+                        stac_item.geometry = geojson
+                        stac_item.bbox = pystac.utils.geometry_to_bbox(geojson)
+                    
+                    item_dict = stac_item.to_dict()
+                    converted_item = convert_json_to_geoserver(item_dict)
+                    request_point = f"collections/{csc_collection.id}/products"
+                    queue_upload(uploads, "POST", request_point, converted_item, stac_item.id, csc_collection.id, next(iter(stac_item.assets.values())).href)
+                    remote_items[stac_item.id] = stac_item
+                    queued_item_ids.add(stac_item.id)
+
+        index_rows.close()
+
+    # Send the Items of the Collection before its extents are updated
+    wait_uploads(uploads, csc_collection.id)
+
+    if added_items or args.update_extents:
+        assets_to_add = generate_metadata_links(data_dicts)
+        csc_collection.assets = assets_to_add
+        csc_collection.update_extent_from_items()
+        collection_dict = csc_collection.to_dict()
+        converted_collection = convert_json_to_geoserver(collection_dict)
+        request_point = f"collections/{csc_collection.id}/"
+
+        r = session.put(urljoin(app_host, request_point), headers=log_headers, json=converted_collection)
+        r.raise_for_status()
+        print(f" + Updated collection extents of {csc_collection.id}.")
+    else:
+        print(f" - No new items for {csc_collection.id}")
+
+    # The fingerprints are recorded only if all the Items of the Collection were uploaded and all the folders of the dataset were listed,
+    # so a failed dataset is checked again on the next run
+    if not any(error["collection_id"] == csc_collection.id for error in uploads["errors"]):
+        for data_dict in update_dicts:
+            if data_dict["data_id"] not in crawl_failures:
+                record_dataset_fingerprint(data_dict["data_id"], dataset_changes[data_dict["data_id"]]["fingerprint"])
+
+def update_catalog_collection(app_host: str, csc_catalog_client: pystac_client.Client, datasets: dict) -> None:
+
+    """
+        Updates the given Collections. The Collections are updated at the same time, at most --parallel_collections at once,
+        and their Items are uploaded by the same upload workers. A failed Collection does not stop the others,
+        the failures are reported after all the Collections have been gone through.
+    """
+
+    # The accepted Items are recorded in the state store, so the next run does not need to fetch the IDs from the STAC API
+    session = create_upload_session(geoserver_pwd, args.upload_workers)
+    uploads = start_uploads(app_host, session, args.upload_workers, on_success=record_upload)
+
+    data_ids = [data_dict["data_id"] for stac_id in datasets for data_dict in datasets[stac_id]]
+    recorded_fingerprints = get_recorded_fingerprints()
+    local_files = None
+    directories = {}
+
+    with db_connection() as conn:
+        fingerprints = get_dataset_fingerprints(conn, data_ids)
+        # Only the directories of the selected datasets are gone through
+        if args.local:
+            directories = get_dataset_directories(conn, data_ids)
+            local_files = get_new_local_files(get_dataset_roots(directories.values()), args.local_days)
+
+    # The local files contain the directories of the new files, so the directory of a dataset is found in them if the dataset has new files
+    dataset_changes = {}
+    for data_id in data_ids:
+        fingerprint = fingerprints.get(data_id, "0")
+        directory = directories.get(data_id, "")
+        dataset_changes[data_id] = {
+            "fingerprint": fingerprint,
+            "rows_changed": recorded_fingerprints.get(str(data_id)) != fingerprint,
+            "local_changes": bool(local_files) and (directory in local_files or directory == "")
+        }
+
+    failed_collections = []
+    crawl_failures = {}
+    with ThreadPoolExecutor(max_workers=args.parallel_collections) as executor:
+        futures = {
+            executor.submit(update_collection, app_host, csc_catalog_client, stac_id, datasets[stac_id], session, uploads, local_files, dataset_changes, crawl_failures): stac_id
+            for stac_id in datasets
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"! Updating {futures[future]} failed: {e}")
+                failed_collections.append(futures[future])
+
+    errors = finish_uploads(uploads)
+    print(f"Uploaded {uploads['uploaded']} items, {len(errors)} failed")
+    if errors:
+        for error in errors:
+            print(f" ! {error['item_id']}: {error['error']}")
+    # The Items were uploaded, only recording them to the state store failed. The store is fixed by the next reconciliation.
+    if uploads["callback_errors"]:
+        print(f"! {len(uploads['callback_errors'])} uploaded items could not be recorded to the state store, use --reconcile on the next run:")
+        for error in uploads["callback_errors"]:
+            print(f" ! {error['item_id']}: {error['error']}")
+    if crawl_failures:
+        print(f"{len(crawl_failures)} datasets could not be listed completely")
+        for data_id, failure in crawl_failures.items():
+            for error in failure["errors"]:
+                print(f" ! {data_id} {error['path']}: {error['error']}")
+
+    # The local files are saved as handled only after the Items have been uploaded,
+    # and the files of the datasets that were not handled completely are checked again on the next run
+    incomplete_collections = set(failed_collections) | {error["collection_id"] for error in errors}
+    incomplete_data_ids = set(crawl_failures) | {data_dict["data_id"] for stac_id in incomplete_collections for data_dict in datasets[stac_id]}
+    save_local_manifest(skip_directories=[directories.get(data_id, "") for data_id in incomplete_data_ids])
+
+    if errors or failed_collections or crawl_failures:
+        raise Exception(f"{len(errors)} uploads failed, {len(failed_collections)} collections failed, {len(crawl_failures)} datasets could not be listed")
+
 if __name__ == "__main__":
 
     start = time.time()
@@ -408,12 +395,17 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--local", action='store_true')
+    parser.add_argument("--local_days", type=int, default=30, help="Number of days a local file counts as new when it's not in the local file manifest")
     parser.add_argument("--add_puhti", action='store_true')
     parser.add_argument("--update_extents", action="store_true")
     parser.add_argument("--port", type=str, help="Port for the paituli database")
     parser.add_argument("--collections", nargs="+", help="Specific collections to be made", required=True)
     parser.add_argument("--host", type=str, help="Hostname of the selected STAC API", required=True)
     parser.add_argument("--db_host", type=str, help="Hostname of the Paituli DB", required=True)
+    parser.add_argument("--no_cache", action="store_true", help="Fetch all the folder listings and raster metadata from the sources instead of using the caches")
+    parser.add_argument("--upload_workers", type=int, default=4, help="Number of concurrent uploads to the GeoServer REST API")
+    parser.add_argument("--parallel_collections", type=int, default=4, help="Number of collections updated at the same time")
+    parser.add_argument("--reconcile", action="store_true", help="Fetch the Item IDs from the STAC API and update the local state store with them")
 
     args = parser.parse_args()
 
@@ -435,20 +427,29 @@ if __name__ == "__main__":
         paituli_pwd = getpass.getpass(prompt="Paituli password: ")
         geoserver_pwd = getpass.getpass(prompt="GeoServer password: ")
 
+    if not args.no_cache:
+        open_listing_cache()
+        open_metadata_cache()
+        open_local_manifest()
+    open_state_store(args.host)
+
     app_host = f"{args.host}/geoserver/rest/oseo/"
     csc_catalog_client = pystac_client.Client.open(f"{args.host}/geoserver/ogc/stac/v1/", headers={"User-Agent":"update-script"})
     
+    # Every Collection thread uses one connection at a time
+    open_db_pool(args.db_host, paituli_port, paituli_pwd, maxconn=args.parallel_collections)
     datasets = get_datasets(args.collections)        
 
-    # Skip updating and sending collection if no items were added
-    # Using a global flag for this might be janky, because if the functions are imported they are still calling the `global added_items_flag`
-    # This is needed to make the update script to run faster if there's nothing to update
-    added_items_flag = False
-
     # Run the script if there's datasets
     if datasets:
         print(f"Updating STAC Catalog at {args.host}")
         update_catalog_collection(app_host, csc_catalog_client, datasets)
 
+    close_db_pool()
+    close_listing_cache()
+    close_metadata_cache()
+    close_local_manifest()
+    close_state_store()
+
     end = time.time()
     print(f"Script took {end-start:.2f} seconds")
\ No newline at end of file
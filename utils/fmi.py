@@ -0,0 +1,218 @@
+import posixpath
+import threading
+import requests
+import pystac
+import rasterio
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+from urllib3.util.retry import Retry
+
+from utils.raster_metadata import read_raster_metadata
+from utils.stac_api import log_headers
+
+# GDAL settings for reading only the headers of the remote rasters. The directory of the file is not listed,
+# the first 32 KB of the file are read in one request at open and the HTTP connections are reused.
+# The extensions are not restricted, since not all the FMI assets end in .tif
+gdal_env = {
+    "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+    "GDAL_INGESTED_BYTES_AT_OPEN": 32768,
+    "GDAL_HTTP_MULTIPLEX": "YES",
+    "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+    "GDAL_HTTP_MAX_RETRY": 3,
+    "GDAL_HTTP_RETRY_DELAY": 1,
+    "VSI_CACHE": "TRUE"
+}
+
+# The normalized Collection dictionaries downloaded during the run, with the URLs as the keys
+collection_cache = {}
+collection_cache_lock = threading.Lock()
+
+def create_fetch_session(pool_size: int = 8, retries: int = 3) -> requests.Session:
+
+    """
+        Returns a requests.Session for downloading the FMI Collection and Item JSON files.
+        The GET requests that fail on a connection error, a rate limit or a server error are retried with a growing delay.
+
+        pool_size - Size of the connection pool, the number of concurrent downloads
+        retries - Number of retries for each request
+    """
+
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"]
+    )
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+def fetch_item(session: requests.Session, url: str, timeout: float = 30) -> pystac.Item:
+
+    """
+        Downloads an Item JSON and returns it as a pystac Item. The URL is set as the self HREF of the Item, so the relative links resolve as with Item.from_file.
+
+        session - Session from create_fetch_session
+        url - URL of the Item JSON
+        timeout - Seconds to wait for the connection and for the response
+    """
+
+    r = session.get(url, headers=log_headers, timeout=timeout)
+    r.raise_for_status()
+
+    return pystac.Item.from_dict(r.json(), href=url, migrate=True)
+
+def normalize_collection_dict(data: dict) -> dict:
+
+    """
+        Fixes the known schema errors of the FMI Collection dictionary in place and returns it.
+        Some FMI Collections have the temporal interval as a single list instead of a list of intervals.
+    """
+
+    interval = data.get("extent", {}).get("temporal", {}).get("interval")
+    if interval and not isinstance(interval[0], list):
+        data["extent"]["temporal"]["interval"] = [interval]
+
+    return data
+
+def fetch_collection_dict(session: requests.Session, url: str, timeout: float = 30) -> dict:
+
+    """
+        Returns the normalized Collection dictionary of the URL. Each URL is downloaded only once during the run.
+    """
+
+    with collection_cache_lock:
+        if url in collection_cache:
+            return collection_cache[url]
+
+    r = session.get(url, headers=log_headers, timeout=timeout)
+    r.raise_for_status()
+    data = normalize_collection_dict(r.json())
+
+    with collection_cache_lock:
+        collection_cache[url] = data
+
+    return data
+
+def fetch_collections(urls: list, workers: int = 8, timeout: float = 30, session: requests.Session | None = None) -> list:
+
+    """
+        Downloads the Collections concurrently and returns them as pystac Collections in the order of the URLs.
+        The downloaded Collections are cached for the run, and a new Collection object is made from the cache on each call,
+        so changing a returned Collection does not change the cached one. Raises an exception naming the URL if a download fails.
+
+        urls - List of the Collection JSON URLs
+        workers - Number of concurrent downloads
+        timeout - Seconds to wait for each request
+        session - Session shared by the downloads, a new one is created if not given
+    """
+
+    if session is None:
+        session = create_fetch_session(workers)
+
+    def fetch(url):
+        try:
+            return pystac.Collection.from_dict(fetch_collection_dict(session, url, timeout), href=url, migrate=True)
+        except Exception as e:
+            raise Exception(f"Collection link is broken {url}: {e}") from e
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(fetch, urls))
+
+def get_link_item_id(link: str) -> str:
+
+    """
+        Returns the Item ID guessed from the file name of the Item link, the FMI Item files are named by their IDs.
+    """
+
+    return posixpath.splitext(posixpath.basename(urlparse(link).path))[0]
+
+def fetch_items(item_links: list, workers: int = 8, timeout: float = 30, session: requests.Session | None = None) -> tuple:
+
+    """
+        Downloads the Items concurrently and returns a tuple of the list of Items and the list of the links that failed.
+        The Items are returned in the order of the links.
+
+        item_links - List of the Item JSON URLs
+        workers - Number of concurrent downloads
+        timeout - Seconds to wait for each request
+        session - Session shared by the downloads, a new one is created if not given
+    """
+
+    if session is None:
+        session = create_fetch_session(workers)
+
+    def fetch(url):
+        try:
+            return fetch_item(session, url, timeout)
+        except Exception as e:
+            print(f" ! {e} on {url}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(fetch, item_links))
+
+    items = [item for item in results if item is not None]
+    errors = [url for url, item in zip(item_links, results) if item is None]
+
+    return items, errors
+
+def read_item_metadata(href: str, version: str | None) -> dict:
+
+    """
+        Returns the raster header fields of the file from read_raster_metadata, reading the file with the gdal_env settings.
+        The rio-stac Item is not made, since its footprint is not used for the FMI Items.
+        The GDAL settings are set in the thread reading the file, so this can be called from the worker threads.
+    """
+
+    with rasterio.Env(**gdal_env):
+        return read_raster_metadata(href, version, with_item=False)
+
+def add_raster_metadata(items: list, workers: int = 8) -> list:
+
+    """
+        Adds the gsd, the EPSG code and the transform read from the header of the first asset to each Item.
+        The headers are read concurrently, and a file shared by several Items is read only once. The updated or created time of the Item
+        is used as the version of the file, so an unchanged file is read from the metadata cache on later runs if the cache is open.
+        A file that can't be read does not stop the others. Returns the list of the Items whose file could not be read,
+        as dictionaries with the Item, the href and the error. These Items are left without the metadata.
+
+        items - List of the FMI Items
+        workers - Number of files read at the same time
+    """
+
+    # The first Item of each file decides the version of the file
+    hrefs = {}
+    for item in items:
+        href = next(iter(item.assets.values())).get_absolute_href()
+        hrefs.setdefault(href, item.properties.get("updated") or item.properties.get("created"))
+
+    def read(href, version):
+        try:
+            return read_item_metadata(href, version), None
+        except Exception as e:
+            return None, e
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        metadata = dict(zip(hrefs, executor.map(read, hrefs.keys(), hrefs.values())))
+
+    failed = []
+    for item in items:
+        href = next(iter(item.assets.values())).get_absolute_href()
+        file_metadata, error = metadata[href]
+        if error is not None:
+            failed.append({"item": item, "href": href, "error": str(error)})
+            continue
+        item.extra_fields["gsd"] = file_metadata["gsd"]
+        # 9391 EPSG code is false, replace by the standard 3067
+        if file_metadata["epsg"] == 9391:
+            item.properties["proj:epsg"] = 3067
+        else:
+            item.properties["proj:epsg"] = file_metadata["epsg"]
+        item.properties["proj:transform"] = file_metadata["transform"]
+
+    return failed
@@ -0,0 +1,150 @@
+import queue
+import threading
+import requests
+from urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
+
+from utils.stac_api import log_headers
+
+def create_upload_session(pwd: str, pool_size: int = 4) -> requests.Session:
+
+    """
+        Returns a requests.Session authenticated to the GeoServer REST API as admin. The session is shared by the upload workers.
+        The uploads are not retried here, a failed upload is recorded by the worker that sent it.
+
+        pwd - GeoServer admin password
+        pool_size - Size of the connection pool, the number of upload workers
+    """
+
+    session = requests.Session()
+    session.auth = ("admin", pwd)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+def upload_worker(pipeline: dict) -> None:
+
+    """
+        Sends the queued requests until the end marker is taken from the queue.
+        A failed request is recorded in the pipeline errors and the worker moves on to the next one.
+        A failure of the on_success callback is recorded in the callback errors, apart from the failed requests.
+    """
+
+    while True:
+        upload = pipeline["queue"].get()
+        try:
+            if upload is None:
+                return
+            r = pipeline["session"].request(
+                upload["method"],
+                urljoin(pipeline["app_host"], upload["request_point"]),
+                headers=log_headers,
+                json=upload["json"]
+            )
+            r.raise_for_status()
+        except Exception as e:
+            with pipeline["lock"]:
+                pipeline["errors"].append({"item_id": upload["item_id"], "collection_id": upload["collection_id"], "request_point": upload["request_point"], "error": str(e)})
+        else:
+            with pipeline["lock"]:
+                pipeline["uploaded"] += 1
+            # The upload has succeeded even if the callback fails, so the callback failures are kept apart from the upload errors
+            if pipeline["on_success"]:
+                try:
+                    pipeline["on_success"](upload)
+                except Exception as e:
+                    with pipeline["lock"]:
+                        pipeline["callback_errors"].append({"item_id": upload["item_id"], "collection_id": upload["collection_id"], "request_point": upload["request_point"], "error": str(e)})
+        finally:
+            if upload is not None:
+                with pipeline["pending_changed"]:
+                    pipeline["pending"][upload["collection_id"]] -= 1
+                    pipeline["pending_changed"].notify_all()
+            pipeline["queue"].task_done()
+
+def start_uploads(app_host: str, session: requests.Session, workers: int = 4, on_success=None) -> dict:
+
+    """
+        Starts the upload workers and returns the pipeline dictionary the uploads are queued to.
+        The queue is bounded, so the item making waits when the uploads fall behind instead of piling the Items in memory.
+
+        app_host - The REST API path for updating the collections
+        session - Session shared by the workers, see create_upload_session
+        workers - Number of concurrent uploads
+        on_success - Optional function called from the worker thread with the upload dictionary after a successful request.
+                     If it raises, the error is recorded in the callback_errors of the pipeline and the upload is still counted as successful
+    """
+
+    pipeline = {
+        "app_host": app_host,
+        "session": session,
+        "queue": queue.Queue(maxsize=workers * 4),
+        "lock": threading.Lock(),
+        "pending": {},
+        "pending_changed": threading.Condition(),
+        "uploaded": 0,
+        "errors": [],
+        "callback_errors": [],
+        "on_success": on_success,
+        "threads": []
+    }
+    for _ in range(workers):
+        thread = threading.Thread(target=upload_worker, args=(pipeline,), daemon=True)
+        thread.start()
+        pipeline["threads"].append(thread)
+
+    return pipeline
+
+def queue_upload(pipeline: dict, method: str, request_point: str, json: dict, item_id: str, collection_id: str | None = None, href: str | None = None) -> None:
+
+    """
+        Queues a request to the REST API. Blocks while the queue is full.
+
+        method - "POST" for new products, "PUT" for updated ones
+        request_point - Path of the request relative to the app_host
+        json - The converted Item or Collection
+        item_id - ID shown in the error report
+        collection_id - ID of the Collection of the Item, passed to on_success
+        href - HREF of the source file of the Item, passed to on_success
+    """
+
+    with pipeline["pending_changed"]:
+        pipeline["pending"][collection_id] = pipeline["pending"].get(collection_id, 0) + 1
+    pipeline["queue"].put({
+        "method": method,
+        "request_point": request_point,
+        "json": json,
+        "item_id": item_id,
+        "collection_id": collection_id,
+        "href": href
+    })
+
+def wait_uploads(pipeline: dict, collection_id: str | None = None) -> None:
+
+    """
+        Waits until the queued requests of the Collection have been sent. The workers are kept running for more uploads.
+        If no Collection is given, waits for all the requests. The Collections can be uploaded at the same time from
+        different threads, and waiting for one of them is not held up by the others.
+    """
+
+    if collection_id is None:
+        pipeline["queue"].join()
+        return
+
+    with pipeline["pending_changed"]:
+        pipeline["pending_changed"].wait_for(lambda: pipeline["pending"].get(collection_id, 0) == 0)
+
+def finish_uploads(pipeline: dict) -> list:
+
+    """
+        Waits for the queued requests, stops the workers and returns the list of the failed uploads.
+    """
+
+    for _ in pipeline["threads"]:
+        pipeline["queue"].put(None)
+    for thread in pipeline["threads"]:
+        thread.join()
+
+    return pipeline["errors"]
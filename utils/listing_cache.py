@@ -0,0 +1,121 @@
+import json
+import time
+
+from utils.sqlite_store import create_store, open_store, close_store, store_open
+
+# The entries of the index pages with the validators the server gave for them
+cache = create_store()
+cache_settings = {
+    "ttl": 6 * 60 * 60,
+    "max_entries": 200000,
+    "entries": 0
+}
+listing_schema = [
+    """
+        create table if not exists listing_entries (
+            url text primary key,
+            entries text not null,
+            etag text,
+            last_modified text,
+            validated real not null,
+            accessed real not null
+        )
+    """
+]
+
+def open_listing_cache(cache_dir: str | None = None, ttl: int = 6 * 60 * 60, max_entries: int = 200000) -> None:
+
+    """
+        Opens the persistent cache of the index page listings. Until this is called, the crawler does not use the cache.
+
+        cache_dir - Directory of the cache database, the .cache directory next to the scripts if not given
+        ttl - Seconds a listing is used without asking the server if it has changed
+        max_entries - Maximum number of listings kept, the least recently used ones are removed first
+    """
+
+    open_store(cache, "listings.sqlite", listing_schema, cache_dir)
+    with cache["lock"]:
+        cache_settings["ttl"] = ttl
+        cache_settings["max_entries"] = max_entries
+        cache_settings["entries"] = cache["connection"].execute("select count(*) from listing_entries").fetchone()[0]
+        evict_listings()
+
+def close_listing_cache() -> None:
+
+    """
+        Closes the listing cache if it's open.
+    """
+
+    close_store(cache)
+
+def listing_cache_open() -> bool:
+
+    """
+        Returns True if the listing cache has been opened.
+    """
+
+    return store_open(cache)
+
+def get_cached_listing(url: str) -> dict | None:
+
+    """
+        Returns the cached listing of the URL as a dictionary with the entries, the ETag and Last-Modified headers,
+        and whether the listing is still fresh and can be used without revalidating it. Returns None if the URL is not cached.
+    """
+
+    with cache["lock"]:
+        row = cache["connection"].execute("select entries, etag, last_modified, validated from listing_entries where url=?", (url,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        cache["connection"].execute("update listing_entries set accessed=? where url=?", (now, url))
+        cache["connection"].commit()
+
+    return {
+        "entries": json.loads(row[0]),
+        "etag": row[1],
+        "last_modified": row[2],
+        "fresh": now - row[3] < cache_settings["ttl"]
+    }
+
+def store_listing(url: str, entries: dict, etag: str | None, last_modified: str | None) -> None:
+
+    """
+        Stores the entries of the listing with the validators the server gave for it.
+    """
+
+    now = time.time()
+    with cache["lock"]:
+        new_entry = cache["connection"].execute("select 1 from listing_entries where url=?", (url,)).fetchone() is None
+        cache["connection"].execute(
+            "insert or replace into listing_entries (url, entries, etag, last_modified, validated, accessed) values (?, ?, ?, ?, ?, ?)",
+            (url, json.dumps(entries), etag, last_modified, now, now)
+        )
+        cache["connection"].commit()
+        if new_entry:
+            cache_settings["entries"] += 1
+            evict_listings()
+
+def mark_listing_validated(url: str) -> None:
+
+    """
+        Marks the cached listing as fresh again after the server answered that it has not changed.
+    """
+
+    now = time.time()
+    with cache["lock"]:
+        cache["connection"].execute("update listing_entries set validated=?, accessed=? where url=?", (now, now, url))
+        cache["connection"].commit()
+
+def evict_listings() -> None:
+
+    """
+        Removes the least recently used listings when the cache is over the size limit. Called with the cache lock held.
+        The cache is trimmed to 90% of the limit, so the removal is not done again for every new listing.
+    """
+
+    if cache_settings["entries"] > cache_settings["max_entries"]:
+        excess = cache_settings["entries"] - int(cache_settings["max_entries"] * 0.9)
+        cache["connection"].execute("delete from listing_entries where url in (select url from listing_entries order by accessed limit ?)", (excess,))
+        cache["connection"].commit()
+        cache_settings["entries"] -= excess
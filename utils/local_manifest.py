@@ -0,0 +1,92 @@
+from utils.sqlite_store import create_store, open_store, close_store, store_open
+
+# The modification times of the local files seen on the last successful run, and the scans waiting to be saved
+manifest = create_store()
+staged_scans = {}
+manifest_schema = [
+    """
+        create table if not exists local_files (
+            path text primary key,
+            mtime real not null
+        )
+    """,
+    "create table if not exists scanned_roots (root text primary key)"
+]
+
+def open_local_manifest(cache_dir: str | None = None) -> None:
+
+    """
+        Opens the manifest of the local file modification times. Until this is called, the new files are found by the time window.
+
+        cache_dir - Directory of the manifest database, the .cache directory next to the scripts if not given
+    """
+
+    open_store(manifest, "local_files.sqlite", manifest_schema, cache_dir)
+
+def close_local_manifest() -> None:
+
+    """
+        Closes the manifest if it's open. The staged scans that have not been saved are dropped.
+    """
+
+    staged_scans.clear()
+    close_store(manifest)
+
+def local_manifest_open() -> bool:
+
+    """
+        Returns True if the manifest has been opened.
+    """
+
+    return store_open(manifest)
+
+def root_scanned(root: str) -> bool:
+
+    """
+        Returns True if the files under the root directory have been saved to the manifest before.
+    """
+
+    with manifest["lock"]:
+        return manifest["connection"].execute("select 1 from scanned_roots where root=?", (root,)).fetchone() is not None
+
+def get_manifest_mtimes(root: str) -> dict:
+
+    """
+        Returns the saved modification times of the files under the root directory as a dictionary with the relative paths as keys.
+    """
+
+    with manifest["lock"]:
+        rows = manifest["connection"].execute("select path, mtime from local_files where substr(path, 1, ?)=?", (len(root), root)).fetchall()
+
+    return {row[0]: row[1] for row in rows}
+
+def stage_manifest(root: str, mtimes: dict) -> None:
+
+    """
+        Keeps the scanned modification times of the root directory until save_local_manifest is called.
+        The manifest is saved only after the new files have been handled, so a failed run reports the same files again.
+    """
+
+    staged_scans[root] = mtimes
+
+def save_local_manifest(skip_directories=()) -> None:
+
+    """
+        Replaces the saved files under each staged root directory with the staged scan in one transaction.
+        The staged roots containing any of the skipped directories are not saved, so their files are reported again on the next run.
+
+        skip_directories - Directories of the datasets whose files were not all handled
+    """
+
+    if not store_open(manifest):
+        return
+
+    with manifest["lock"], manifest["connection"]:
+        for root, mtimes in staged_scans.items():
+            if any(directory.startswith(root) or root.startswith(directory) for directory in skip_directories):
+                print(f"! Not saving the local files under {root}, they are checked again on the next run")
+                continue
+            manifest["connection"].execute("delete from local_files where substr(path, 1, ?)=?", (len(root), root))
+            manifest["connection"].executemany("insert or replace into local_files (path, mtime) values (?, ?)", mtimes.items())
+            manifest["connection"].execute("insert or replace into scanned_roots (root) values (?)", (root,))
+    staged_scans.clear()
@@ -1,216 +1,590 @@
 import requests
 import datetime
+import calendar
 import os
 import re
 import pystac
+import threading
+import pandas as pd
+import zoneinfo
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
 
-def recursive_filecheck(url: str, links: list[str], recursive_links: list) -> list:
+from utils.listing_cache import listing_cache_open, get_cached_listing, store_listing, mark_listing_validated
+from utils.local_manifest import local_manifest_open, root_scanned, get_manifest_mtimes, stage_manifest
+
+# Shared state of the directory crawler
+listing_session = None
+fetched_listings = {}
+listing_lock = threading.Lock()
+
+# Patterns of the timestamp rules and the rules compiled for each dataset
+year_regex = re.compile(r'(19\d{2}(?![\d_])|20\d{2}(?![\d_])|21\d{2}(?![\d_]))(-(?=\d{4}))?')
+number_regex = re.compile(r'^\d+$')
+label_regex = re.compile(r'(?<=\()18\d{2}(?=\))|(?<=\()19\d{2}(?=\))|(?<=\()20\d{2}(?=\))')
+compiled_rules = {}
+
+# The index pages show the modification times in the local time of the server
+listing_timezone = zoneinfo.ZoneInfo("Europe/Helsinki")
+
+# Modification time formats used in the index pages
+listing_date_formats = [
+    (re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}(:\d{2})?"), ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"]),
+    (re.compile(r"\d{2}-[A-Za-z]{3}-\d{4} \d{2}:\d{2}(:\d{2})?"), ["%d-%b-%Y %H:%M:%S", "%d-%b-%Y %H:%M"])
+]
+
+def get_listing_session() -> requests.Session:
 
     """
-        Goes through the files in the given URL and recursively checks them for appropriate files
+        Returns the session shared by the directory crawler. The connection pool is sized for the crawler threads.
     """
 
-    for link in links:
-        if link["href"].startswith("?") or link["href"].startswith("/"):
-            continue
+    global listing_session
+
+    with listing_lock:
+        if listing_session is None:
+            listing_session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+            listing_session.mount("https://", adapter)
+            listing_session.mount("http://", adapter)
+
+    return listing_session
+
+def parse_listing_date(text: str) -> str | None:
+
+    """
+        Returns the first modification time found in the text of a listing row as an ISO formatted string, or None if there's none.
+        The time is in the local time of the server, see listing_time_to_utc.
+    """
+
+    for pattern, formats in listing_date_formats:
+        match = pattern.search(text)
+        if match:
+            for date_format in formats:
+                try:
+                    return datetime.datetime.strptime(match.group(0), date_format).isoformat()
+                except ValueError:
+                    continue
+
+    return None
+
+def listing_time_to_utc(modified: str) -> str:
+
+    """
+        Converts a modification time of the listing from the local time of the server to UTC, so it matches the Last-Modified header.
+        Returned as a naive ISO formatted string like the Last-Modified times.
+    """
+
+    local_time = datetime.datetime.fromisoformat(modified).replace(tzinfo=listing_timezone)
+
+    return local_time.astimezone(datetime.timezone.utc).replace(tzinfo=None).isoformat()
+
+def fetch_listing(url: str) -> dict:
+
+    """
+        Returns the entries of the given index page as a dictionary with the link href as the key and the modification time
+        shown on the page as the value (None if the page does not show it). Sorting and parent directory links are left out.
+        Each page is fetched only once per run, so pages shared between datasets are not fetched again.
+        If the persistent listing cache is open, fresh listings are taken from it and the older ones are revalidated
+        with a conditional request, so an unchanged page costs a 304 response instead of downloading and parsing it.
+        Raises an exception if the page can't be listed.
+    """
+
+    with listing_lock:
+        if url in fetched_listings:
+            return fetched_listings[url]
+
+    cached = get_cached_listing(url) if listing_cache_open() else None
+    if cached and cached["fresh"]:
+        entries = cached["entries"]
+    else:
+        headers = {}
+        if cached and cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+        page = get_listing_session().get(url, headers=headers)
+        if page.status_code == 304 and cached:
+            mark_listing_validated(url)
+            entries = cached["entries"]
+        elif page.status_code == 200:
+            soup = BeautifulSoup(page.text, features="lxml")
+            entries = {}
+            for link in soup.find_all("a", href=True):
+                href = link["href"]
+                if href.startswith(("?", "/", "../", "http:", "https:")):
+                    continue
+                # The modification time is in the same table row or in the text right after the link
+                row = link.find_parent("tr")
+                row_text = row.get_text(" ") if row else str(link.next_sibling or "")
+                entries[href] = parse_listing_date(row_text)
+            if listing_cache_open():
+                store_listing(url, entries, page.headers.get("ETag"), page.headers.get("Last-Modified"))
         else:
-            if link["href"].endswith("/"):
-                page = requests.get(url+link["href"])
-                data = page.text
-                soup = BeautifulSoup(data, features="html.parser")
-                for a in soup.find_all("a"):
-                    if a["href"].startswith("?") or a["href"].startswith("/"):
-                        continue
+            # A failed page is not cached, so the files under it are not taken as missing
+            raise requests.HTTPError(f"Could not list {url}: {page.status_code}", response=page)
+
+    with listing_lock:
+        fetched_listings[url] = entries
+
+    return entries
+
+def list_directory_files(url: str, workers: int = 8) -> list[str]:
+
+    """
+        Goes through the given index page and its subdirectories breadth-first and returns the files relative to the given URL.
+        The pages of each directory level are fetched concurrently.
+
+        Raises an exception if any of the pages can't be listed, so an incomplete crawl is not taken as the files of the directory.
+
+        url - URL of the index page, ending in "/"
+        workers - Number of pages fetched at the same time
+    """
+
+    files = []
+    visited = {""}
+    level = [""]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while level:
+            listings = executor.map(lambda directory: fetch_listing(url + directory), level)
+            next_level = []
+            for directory, entries in zip(level, listings):
+                for href in entries:
+                    if href.endswith("/"):
+                        if directory + href not in visited:
+                            visited.add(directory + href)
+                            next_level.append(directory + href)
                     else:
-                        a["href"] = link["href"] + a["href"]
-                        links.append(a)
-                links.remove(link)
-                recursive_filecheck(url+link["href"], links, recursive_links)
-            else:
-                recursive_links.append(link)
-    
-    return recursive_links
+                        files.append(directory + href)
+            level = next_level
+
+    return files
+
+def resolve_file(path: str) -> tuple[str, str | None]:
+
+    """
+        Returns the path of the file with the right case of the file extension and its modification time in UTC as an ISO formatted string.
+        Both come from the listing of the file's folder, which is fetched once for all the files in it.
+        If the file or its modification time is not found from the listing, the file is checked with a HEAD request
+        and if the default extension returns 404, the extension is switched to uppercase.
+    """
+
+    directory, filename = path.rsplit("/", 1)
+    name, extension = os.path.splitext(filename)
+    try:
+        entries = fetch_listing(directory + "/")
+    except Exception:
+        entries = {}
+
+    for candidate in [filename, name + extension.upper()]:
+        for href in [candidate, quote(candidate)]:
+            if entries.get(href):
+                return f"{directory}/{candidate}", listing_time_to_utc(entries[href])
+
+    r = get_listing_session().head(path)
+    if r.status_code == 404:
+        path = f"{directory}/{name}{extension.upper()}"
+        r = get_listing_session().head(path)
+
+    if "Last-Modified" in r.headers:
+        modified = datetime.datetime.strptime(r.headers["Last-Modified"], "%a, %d %b %Y %H:%M:%S %Z").isoformat()
+    else:
+        modified = None
+
+    return path, modified
+
+def create_data_asset(path: str, metadata: dict, asset_id: str, media_type: str) -> pystac.Asset:
+
+    """
+        Makes the data asset of a file from the metadata given by read_raster_metadata.
+
+        path - URL of the file
+        asset_id - ID of the asset, also used as the title
+        media_type - Media type string of the file
+    """
+
+    return pystac.Asset(
+        href = path,
+        media_type = media_type,
+        title = asset_id,
+        roles = ["data"],
+        extra_fields = {
+            "gsd": metadata["gsd"],
+            "proj:shape": metadata["shape"],
+            "proj:transform": metadata["transform"]
+        }
+    )
+
+def get_item_epsg(epsg: int | None, path: str, data_dict: dict, item_media_type: str) -> int | None:
+
+    """
+        Returns the EPSG code for the Item. NetCDF datasets are in 3067.
+        If the file has no CRS, the code is taken from the coordinate system of the dataset or from the KKJ zone in the path.
+
+        epsg - EPSG code read from the file, None if the file has no CRS
+    """
+
+    if item_media_type == "NetCDF":
+        return 3067
+
+    if epsg:
+        return epsg
+
+    if data_dict["coord_sys"] == "ETRS-TM35FIN" or data_dict["coord_sys"] == "WGS84/ETRS-TM35FIN":
+        return 3067
+
+    kkj_codes = {
+        "kkj": 4123,
+        "kkj0": 3386,
+        "kkj1": 2391,
+        "kkj2": 2392,
+        "kkj3": 2393,
+        "kkj4": 2394,
+        "kkj5": 3387
+    }
+    if "compress95" in path:
+        # Take the KKJ Zone from the path
+        path_kkj = path.split("/")[-7]
+        if path_kkj in kkj_codes:
+            return kkj_codes[path_kkj]
+    elif "thematic_rasters" in data_dict["stac_id"]:
+        return kkj_codes["kkj3"]
+
+    return None
+
+def get_dataset_roots(directories: list) -> list:
+
+    """
+        Returns the given dataset directories without the ones inside the other directories, see get_dataset_directories in utils.paituli_db.
+    """
+
+    roots = sorted(set(directories))
+
+    return [root for i, root in enumerate(roots) if not any(root.startswith(other) for other in roots[:i])]
+
+def scan_files(directory: str):
+
+    """
+        Yields the paths and the modification times of the files under the directory.
+        Uses os.scandir, so the file type and the stat come from the directory entries without extra system calls where possible.
+        Symbolic links to directories are not followed, the same as with os.walk.
+    """
+
+    stack = [directory]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        yield entry.path, entry.stat().st_mtime
+        except (FileNotFoundError, PermissionError, NotADirectoryError):
+            continue
 
-def get_new_local_files() -> list:
+def get_new_local_files(roots: list | None = None, days: int = 30, directory: str = "/geodata/") -> set:
 
     """
-        Goes through the given directory and returns the files that have been modified recently (30 days).
+        Goes through the given dataset directories and returns the files that are new or changed.
+        Returns a set of the relative paths without the file extension, and the directories containing them,
+        so checking an index_wgs84 path against it does not depend on the number of files.
+
+        If the local manifest is open and the directory has been saved to it before, the files added or modified since the
+        saved run are returned. Otherwise the files that have been modified within the given number of days are returned.
+        The scan is staged to the manifest and saved with save_local_manifest after the files have been handled.
+
+        roots - Directories relative to the given directory, see get_dataset_roots. If None, the whole directory is gone through
+        days - Number of days a file counts as new when the manifest is not used
+        directory - The local data root
     """
 
-    new_paths = []
-    directory = "/geodata/"
-    target_date = datetime.datetime.now() - datetime.timedelta(days=30)
+    new_paths = set()
+    target_date = datetime.datetime.now() - datetime.timedelta(days=days)
+    cutoff = datetime.datetime.combine(target_date.date(), datetime.time.min).timestamp()
+
+    for root in roots if roots is not None else [""]:
+        use_manifest = local_manifest_open() and root_scanned(root)
+        previous_mtimes = get_manifest_mtimes(root) if use_manifest else {}
+        mtimes = {}
+
+        for file_path, mtime in scan_files(os.path.join(directory, root)):
+            relative_path = file_path[len(directory):]
+            mtimes[relative_path] = mtime
 
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            file_path = os.path.join(root, file)
-            modification_time = datetime.datetime.fromtimestamp(os.path.getmtime(file_path))
-            split_path = file_path.split(".")
-            if modification_time.date() >= target_date.date() and len(split_path) >= 2:
-                modified_path = split_path[-2].replace(directory.replace(".", ""), "")
-                new_paths.append(modified_path)
+            if use_manifest:
+                new_file = previous_mtimes.get(relative_path) != mtime
+            else:
+                new_file = mtime >= cutoff
+
+            split_path = relative_path.split(".")
+            if new_file and len(split_path) >= 2:
+                new_paths.add(split_path[0])
+                # Add the directories of the file, so the paths pointing to a directory are found as well
+                parent = os.path.dirname(split_path[0])
+                while parent and parent not in new_paths:
+                    new_paths.add(parent)
+                    new_paths.add(parent + "/")
+                    parent = os.path.dirname(parent)
+
+        if local_manifest_open():
+            stage_manifest(root, mtimes)
 
     return new_paths
 
-def generate_timestamps(path: str, data_dict: dict, label: str | None) -> dict:
+def year_start(year: str) -> datetime.datetime:
+
+    """
+        Returns the first day of the year. Four digit years are made directly, anything else goes through strptime as before.
+    """
+
+    if len(year) == 4 and year.isdigit():
+        return datetime.datetime(int(year), 1, 1)
+
+    return datetime.datetime.strptime(f"{year}-01-01 00:00:00", "%Y-%m-%d %H:%M:%S")
+
+def year_end(year: str) -> datetime.datetime:
 
     """
+        Returns the last day of the year. Four digit years are made directly, anything else goes through strptime as before.
+    """
+
+    if len(year) == 4 and year.isdigit():
+        return datetime.datetime(int(year), 12, 31)
+
+    return datetime.datetime.strptime(f"{year}-12-31 00:00:00", "%Y-%m-%d %H:%M:%S")
+
+def month_span(numbers: str) -> tuple:
+
+    """
+        Returns the first and the last day of the month given as YYYYMM.
+    """
+
+    if len(numbers) == 6:
+        item_starttime = datetime.datetime(int(numbers[:4]), int(numbers[4:]), 1)
+    else:
+        item_starttime = datetime.datetime.strptime(f"{numbers}-01", "%Y%m-%d")
+    item_endtime = item_starttime.replace(day=calendar.monthrange(item_starttime.year, item_starttime.month)[1])
+
+    return item_starttime, item_endtime
+
+def compile_timestamp_rule(data_dict: dict):
+
+    """
+    Returns a function (path, label) -> dict giving the timestamps of the files of the dataset.
+    The rules that depend only on the dataset are resolved here once, and the function only runs the ones that depend on the file.
     A bunch of different scenarios for timestamps:
-     - If dataset has only the latest data, get the Last-Modified header from the file
+     - If dataset has only the latest data, get the modification time of the file from the folder listing
      - If the database year has a span of multiple years, set the timespan accordingly
      - If the dataset contains monthly data, get the year and month from filename
      - Else, try to get the year from the full path of the file
      - Lastly, if the path does not contain the year, take the last year from the database year-field
     """
 
-    year_pattern = r'(19\d{2}(?![\d_])|20\d{2}(?![\d_])|21\d{2}(?![\d_]))(-(?=\d{4}))?'
-    number_pattern = r'^\d+$'
-    label_pattern = r'(?<=\()18\d{2}(?=\))|(?<=\()19\d{2}(?=\))|(?<=\()20\d{2}(?=\))'
-    
-    # National Land Survey of Finland old maps has the year in the label
-    if label:
-        check_label = re.search(label_pattern, label)
-    else:
-        check_label = None
-
-    if "nls_digital_elevation_model_2m" in data_dict['stac_id']: # This gets the time for 2m DEM, there's no better alternative
-        resp = requests.head(path)
-        modified = resp.headers["Last-Modified"]
-        item_starttime = datetime.datetime.strptime(modified, "%a, %d %b %Y %H:%M:%S %Z")
-        item_endtime = datetime.datetime.strptime(modified, "%a, %d %b %Y %H:%M:%S %Z")
-        item_date = item_starttime.year
-    elif "nls_topographic_map_42k" in data_dict['stac_id'] and "x" in data_dict['year']: #Some datasets have years as 192x
-        item_starttime = datetime.datetime.strptime(f"1920-01-01 00:00:00", "%Y-%m-%d %H:%M:%S")
-        item_endtime = datetime.datetime.strptime(f"1930-12-31 00:00:00", "%Y-%m-%d %H:%M:%S")
-        item_date = f"{item_starttime.year}_{item_endtime.year}"
-    elif check_label: # If year in label, use that
-        label_year = check_label.group(0)
-        item_starttime = datetime.datetime.strptime(f"{label_year}-01-01 00:00:00", "%Y-%m-%d %H:%M:%S")
-        item_endtime = datetime.datetime.strptime(f"{label_year}-12-31 00:00:00", "%Y-%m-%d %H:%M:%S")
-        item_date = label_year
-    elif label and "(-)" in label and data_dict["org_eng"] == "National Land Survey of Finland": # If label year is blank, the year is unknown
-        split_year = data_dict["year"].split("-")
-        item_starttime = datetime.datetime.strptime(f"{split_year[0]}-01-01 00:00:00", "%Y-%m-%d %H:%M:%S")
-        item_endtime = datetime.datetime.strptime(f"{split_year[1]}-12-31 00:00:00", "%Y-%m-%d %H:%M:%S")
-        item_date = f"{split_year[0]}_{split_year[1]}"
-    elif "-" not in data_dict["year"]: # If only one year in dataset, use that
-        item_starttime = datetime.datetime.strptime(f"{data_dict['year']}-01-01 00:00:00", "%Y-%m-%d %H:%M:%S")
-        item_endtime = datetime.datetime.strptime(f"{data_dict['year']}-12-31 00:00:00", "%Y-%m-%d %H:%M:%S")
-        item_date = data_dict["year"]
-    elif "snow_load_on_trees" in data_dict["stac_id"]: # filename is type rcp**{startyear}{endyear}
-        split_file = path.split("/")[-1].split(".")[0]
-        start_year = split_file[-8:-4]
-        end_year = split_file[-4:]
-        item_starttime = datetime.datetime.strptime(f"{start_year}-01-01 00:00:00", "%Y-%m-%d %H:%M:%S")
-        item_endtime = datetime.datetime.strptime(f"{end_year}-12-31 00:00:00", "%Y-%m-%d %H:%M:%S")
-        item_date = f"{start_year}_{end_year}"
-    elif "predictions" in data_dict["stac_id"]:
+    stac_id = data_dict["stac_id"]
+    year = data_dict["year"]
+
+    def timestamps(item_starttime, item_endtime, item_date) -> dict:
+        return {
+            "item_start_time": item_starttime,
+            "item_end_time": item_endtime,
+            "item_date": item_date
+        }
+
+    if "nls_digital_elevation_model_2m" in stac_id: # This gets the time for 2m DEM, there's no better alternative
+        def dem_rule(path, label):
+            modified = datetime.datetime.fromisoformat(resolve_file(path)[1])
+            return timestamps(modified, modified, modified.year)
+        return dem_rule
+
+    if "nls_topographic_map_42k" in stac_id and "x" in year: #Some datasets have years as 192x
+        def decade_rule(path, label):
+            return timestamps(datetime.datetime(1920, 1, 1), datetime.datetime(1930, 12, 31), "1920_1930")
+        return decade_rule
+
+    # The rules used when the label does not contain the year
+    if "-" not in year: # If only one year in dataset, use that
+        def dataset_rule(path):
+            return timestamps(year_start(year), year_end(year), year)
+    elif "snow_load_on_trees" in stac_id: # filename is type rcp**{startyear}{endyear}
+        def dataset_rule(path):
+            split_file = path.split("/")[-1].split(".")[0]
+            start_year = split_file[-8:-4]
+            end_year = split_file[-4:]
+            return timestamps(year_start(start_year), year_end(end_year), f"{start_year}_{end_year}")
+    elif "predictions" in stac_id:
         # There are some datasets with parantheses in the years column
-        if len(data_dict['year'].split('(')) > 1: # Monthly mean precipitation and temperature predictions
-            split_fix = data_dict['year'].split('(')[0].strip()
-            split_years = split_fix.split('-')
+        if len(year.split('(')) > 1: # Monthly mean precipitation and temperature predictions
+            split_years = year.split('(')[0].strip().split('-')
         else:
-            split_years = data_dict['year'].split('-')
-        item_starttime = datetime.datetime.strptime(f"{split_years[0]}-01-01 00:00:00", "%Y-%m-%d %H:%M:%S")
-        item_endtime = datetime.datetime.strptime(f"{split_years[1]}-12-31 00:00:00", "%Y-%m-%d %H:%M:%S")
-        item_date = f"{split_years[0]}_{split_years[1]}"
-    elif "monthly_avg" in data_dict["stac_id"] or "monthly_precipitation_1km" in data_dict["stac_id"]:
-        split_file = path.split("/")[-1].split(".")[0].split("_")
-        for split in split_file:
-            match = re.search(number_pattern, split)
-            if match:
-                numbers = match.group(0)
-                item_starttime = datetime.datetime.strptime(f"{numbers}-01", "%Y%m-%d")
-                # Calculate the last day of the corresponding month
-                first_day_of_next_month = item_starttime + datetime.timedelta(days=32)
-                lastday = first_day_of_next_month - datetime.timedelta(days=first_day_of_next_month.day)
-                item_endtime = datetime.datetime.strptime(f"{numbers}-{lastday.day}", "%Y%m-%d")
-                item_date = numbers
+            split_years = year.split('-')
+        def dataset_rule(path):
+            return timestamps(year_start(split_years[0]), year_end(split_years[1]), f"{split_years[0]}_{split_years[1]}")
+    elif "monthly_avg" in stac_id or "monthly_precipitation_1km" in stac_id:
+        def dataset_rule(path):
+            for split in path.split("/")[-1].split(".")[0].split("_"):
+                if number_regex.search(split):
+                    item_starttime, item_endtime = month_span(split)
+                    item_date = split
+            return timestamps(item_starttime, item_endtime, item_date)
     else:
-        match = re.search(year_pattern, path)
+        split_year = year.split("-")
         # Some HY SPECTRE data items have the publication date in the path and not the data date
-        if match and not data_dict['stac_id'].startswith("hy_spectre"):
-            if match.group(1) not in data_dict['stac_id']:
-                year = match.group(1)
-                item_starttime = datetime.datetime.strptime(f"{year}-01-01 00:00:00", "%Y-%m-%d %H:%M:%S")
-                item_endtime = datetime.datetime.strptime(f"{year}-12-31 00:00:00", "%Y-%m-%d %H:%M:%S")
-                item_date = year
-            else:
-                split_year = data_dict["year"].split("-")
-                item_starttime = datetime.datetime.strptime(f"{split_year[0]}-01-01 00:00:00", "%Y-%m-%d %H:%M:%S")
-                item_endtime = datetime.datetime.strptime(f"{split_year[1]}-12-31 00:00:00", "%Y-%m-%d %H:%M:%S")
-                item_date = f"{split_year[0]}_{split_year[1]}"
-        else:
-            split_year = data_dict["year"].split("-")
-            item_starttime = datetime.datetime.strptime(f"{split_year[0]}-01-01 00:00:00", "%Y-%m-%d %H:%M:%S")
-            item_endtime = datetime.datetime.strptime(f"{split_year[1]}-12-31 00:00:00", "%Y-%m-%d %H:%M:%S")
-            item_date = f"{split_year[0]}_{split_year[1]}"
-
-    item_timestamps = {
-        "item_start_time": item_starttime,
-        "item_end_time": item_endtime,
-        "item_date": item_date
-    }
+        use_path_year = not stac_id.startswith("hy_spectre")
+        def dataset_rule(path):
+            match = year_regex.search(path) if use_path_year else None
+            if match and match.group(1) not in stac_id:
+                path_year = match.group(1)
+                return timestamps(year_start(path_year), year_end(path_year), path_year)
+            return timestamps(year_start(split_year[0]), year_end(split_year[1]), f"{split_year[0]}_{split_year[1]}")
 
-    return item_timestamps
+    blank_label_years = data_dict["org_eng"] == "National Land Survey of Finland"
 
-def generate_item_id(path: str, data_dict: dict, item_date: str, label: str | None) -> str:
+    def label_rule(path, label):
+        if label:
+            # National Land Survey of Finland old maps has the year in the label
+            check_label = label_regex.search(label)
+            if check_label: # If year in label, use that
+                label_year = check_label.group(0)
+                return timestamps(year_start(label_year), year_end(label_year), label_year)
+            if blank_label_years and "(-)" in label: # If label year is blank, the year is unknown
+                split_year = year.split("-")
+                return timestamps(year_start(split_year[0]), year_end(split_year[1]), f"{split_year[0]}_{split_year[1]}")
+        return dataset_rule(path)
+
+    return label_rule
+
+def compile_item_id_rule(data_dict: dict):
 
     """
-        Generate the Item IDs from the given information. 
+        Returns a function (path, item_date, label) -> str giving the Item IDs of the files of the dataset.
         This was done mainly through trial and error when any given dataset was widely different from previous ones.
         If new datasets give wrong or similar IDs for different items, feel free to add new rules
     """
 
-    # This specific dataset has an incomplete filepath in the dataset
-    if "ei_kkayria" in path and item_date == "2006":
-        split_path = path.split(".")
-        path = ".".join(split_path[:-1]) + "_RK2_2.tif"
+    stac_id = data_dict["stac_id"]
 
-    if label:
-        if label == item_date:
-            item_id = f"{data_dict['stac_id']}_{label}"
-        else:
-            item_id = f"{data_dict['stac_id']}_{label}_{item_date}"
-    else:
-        item_name = path.split("/")[-1].split(".")[0].split("_")[0].lower()
-        item_name = item_name.replace("-", "_")
-        item_id = f"{data_dict['stac_id']}_{item_name}_{item_date}"
+    def file_name(path):
+        return path.split("/")[-1].split(".")[0].split("_")[0].lower().replace("-", "_")
 
     # For orthoimages, construct a different ID, which includes the dataset, elevation model, and the version number
-    if "orthoimage" in data_dict['stac_id']:
-        if label:
-            item_id = f"{data_dict['stac_id']}_{label}_{item_date}_{path.split('/')[-6]}_{path.split('/')[-3]}_{path.split('/')[-2]}"
-        else:
-            leaf = path.split("/")[-1].split(".")[0]
-            item_id = f"{data_dict['stac_id']}_{leaf}_{item_date}_{path.split('/')[-6]}_{path.split('/')[-3]}_{path.split('/')[-2]}"
-    elif "general_map" in data_dict['stac_id']:
-        split = path.split(".")[-2].split("_")
-        item_name = "".join(split)
-        item_id = f"{data_dict['stac_id']}_{item_name}_{item_date}"
-    elif "predictions" in data_dict["stac_id"] and "monthly" in data_dict["stac_id"]:
-        split = path.split("/")[-1].split(".")[-2].split("_")
-        item_name = "_".join(split[0:3])
-        item_id = f"{data_dict['stac_id']}_{item_name}_{item_date}"
-    elif data_dict["stac_id"].startswith("hy"):
-        item_id = f"{data_dict['stac_id']}_{item_date}"
-    elif "nls_topographic_map_42k" in data_dict['stac_id'] and "x" in data_dict['year']:
-        item_name = path.split("/")[-1].split(".")[0].split("_")[0].lower()
-        item_name = item_name.replace("-", "_")
-        item_id = f"{data_dict['stac_id']}_{item_name}_{item_date}"
-
-    # Some IDs have periods in them, remove them
-    if "." in item_id:
-        item_id = item_id.replace(".", "")
-    # Something fishy going with label having / in it even though it doesn't show up in database
-    elif "/" in item_id:
-        split = item_id.split("_")
-        label_split = split[-2]
-        fix = label_split.split("/")[-1]
-        item_id = item_id.replace(label_split, fix)
-
-    return item_id
+    if "orthoimage" in stac_id:
+        def make_id(path, item_date, label):
+            split_path = path.split("/")
+            name = label if label else split_path[-1].split(".")[0]
+            return f"{stac_id}_{name}_{item_date}_{split_path[-6]}_{split_path[-3]}_{split_path[-2]}"
+    elif "general_map" in stac_id:
+        def make_id(path, item_date, label):
+            return f"{stac_id}_{''.join(path.split('.')[-2].split('_'))}_{item_date}"
+    elif "predictions" in stac_id and "monthly" in stac_id:
+        def make_id(path, item_date, label):
+            return f"{stac_id}_{'_'.join(path.split('/')[-1].split('.')[-2].split('_')[0:3])}_{item_date}"
+    elif stac_id.startswith("hy"):
+        def make_id(path, item_date, label):
+            return f"{stac_id}_{item_date}"
+    elif "nls_topographic_map_42k" in stac_id and "x" in data_dict["year"]:
+        def make_id(path, item_date, label):
+            return f"{stac_id}_{file_name(path)}_{item_date}"
+    else:
+        def make_id(path, item_date, label):
+            if label:
+                if label == item_date:
+                    return f"{stac_id}_{label}"
+                return f"{stac_id}_{label}_{item_date}"
+            return f"{stac_id}_{file_name(path)}_{item_date}"
+
+    def item_id_rule(path, item_date, label):
+        # This specific dataset has an incomplete filepath in the dataset
+        if "ei_kkayria" in path and item_date == "2006":
+            path = ".".join(path.split(".")[:-1]) + "_RK2_2.tif"
+
+        item_id = make_id(path, item_date, label)
+
+        # Some IDs have periods in them, remove them
+        if "." in item_id:
+            item_id = item_id.replace(".", "")
+        # Something fishy going with label having / in it even though it doesn't show up in database
+        elif "/" in item_id:
+            label_split = item_id.split("_")[-2]
+            item_id = item_id.replace(label_split, label_split.split("/")[-1])
+
+        return item_id
+
+    return item_id_rule
+
+def get_dataset_rules(data_dict: dict) -> dict:
+
+    """
+        Returns the compiled timestamp and Item ID functions of the dataset. The functions are compiled once per dataset.
+    """
+
+    key = (data_dict["stac_id"], data_dict["year"], data_dict["org_eng"])
+    rules = compiled_rules.get(key)
+    if rules is None:
+        rules = {
+            "timestamps": compile_timestamp_rule(data_dict),
+            "item_id": compile_item_id_rule(data_dict)
+        }
+        compiled_rules[key] = rules
+
+    return rules
+
+def generate_timestamps(path: str, data_dict: dict, label: str | None) -> dict:
+
+    """
+        Returns the start and end times and the date string of the file, see compile_timestamp_rule.
+    """
+
+    return get_dataset_rules(data_dict)["timestamps"](path, label)
+
+def generate_item_id(path: str, data_dict: dict, item_date: str, label: str | None) -> str:
+
+    """
+        Generate the Item ID of the file, see compile_item_id_rule.
+    """
+
+    return get_dataset_rules(data_dict)["item_id"](path, item_date, label)
+
+def generate_item_frame(paths: list, labels: list, data_dict: dict) -> pd.DataFrame:
+
+    """
+        Makes the timestamps and the Item IDs of all the files of a dataset at once.
+        The dataset rules are compiled once and run over the files, and the duplicate IDs are found in one pass over the frame.
+        Returns a DataFrame with the columns:
+         - path, label: The given files
+         - item_start_time, item_end_time, item_date: See generate_timestamps
+         - item_id: See generate_item_id
+         - duplicate: True if another file of the dataset gets the same Item ID
+
+        The new files are then found with item_frame[~item_frame["item_id"].isin(remote_ids)].
+
+        paths - List of the URLs of the files
+        labels - List of the labels of the files, None if the file has no label
+        data_dict - Dictionary of the dataset from the Postgresql DB
+    """
+
+    rules = get_dataset_rules(data_dict)
+    timestamp_rule = rules["timestamps"]
+    item_id_rule = rules["item_id"]
+
+    timestamps = [timestamp_rule(path, label) for path, label in zip(paths, labels)]
+    item_dates = [timestamp["item_date"] for timestamp in timestamps]
+
+    # The columns are kept as objects, so the values are the same as given by the single file functions
+    item_frame = pd.DataFrame({
+        "path": pd.Series(paths, dtype=object),
+        "label": pd.Series(labels, dtype=object),
+        "item_start_time": pd.Series([timestamp["item_start_time"] for timestamp in timestamps], dtype=object),
+        "item_end_time": pd.Series([timestamp["item_end_time"] for timestamp in timestamps], dtype=object),
+        "item_date": pd.Series(item_dates, dtype=object),
+        "item_id": pd.Series([item_id_rule(path, item_date, label) for path, item_date, label in zip(paths, item_dates, labels)], dtype=object)
+    })
+    item_frame["duplicate"] = item_frame["item_id"].duplicated(keep=False)
+
+    return item_frame
 
 def generate_metadata_links(dataset_dict: dict) -> dict:
     """
@@ -0,0 +1,197 @@
+import os
+import itertools
+import threading
+import contextlib
+from psycopg2 import extensions
+from psycopg2.pool import ThreadedConnectionPool
+
+# The pool is shared by the threads of the scripts. The prepared statements are kept per connection.
+db_pool = None
+prepared_connections = {}
+prepare_lock = threading.Lock()
+
+dataset_columns = ["data_id", "stac_id", "org_eng", "name_eng", "scale", "year", "format_eng", "coord_sys", "license_url", "metadata"]
+
+# The parameter types are taken from the columns, so the statements work with the type of the data_id column
+prepared_statements = {
+    "select_datasets": "select data_id, stac_id, org_eng, name_eng, scale, year, format_eng, coord_sys, license_url, meta from dataset where access=1 and stac_id=ANY($1)",
+    "select_all_datasets": "select data_id, stac_id, org_eng, name_eng, scale, year, format_eng, coord_sys, license_url, meta from dataset where access=1 and stac_id IS NOT NULL",
+    "select_dataset_roots": "select data_id, min(path), max(path) from index_wgs84 where data_id=ANY($1) group by data_id",
+    "select_dataset_fingerprints": "select data_id, count(*), max(gid), md5(string_agg(concat_ws(':', gid, path, label), ',' order by gid)) from index_wgs84 where data_id=ANY($1) group by data_id"
+}
+
+def open_db_pool(host: str, port: str, password: str, maxconn: int = 4) -> None:
+
+    """
+        Opens the pool of connections to the Paituli DB. The connections are opened once here and kept open until close_db_pool,
+        because the pool closes the connections returned to it over its minimum size.
+
+        host - Hostname of the Paituli DB
+        port - Port of the Paituli DB
+        password - Password of the paituli-ro user
+        maxconn - Maximum number of connections, should be at least the number of threads using the DB at the same time
+    """
+
+    global db_pool
+
+    db_pool = ThreadedConnectionPool(
+        maxconn,
+        maxconn,
+        host=host,
+        port=port,
+        user="paituli-ro",
+        password=password,
+        dbname="paituli",
+        keepalives=1,
+        keepalives_idle=30,
+        keepalives_interval=10,
+        keepalives_count=5
+    )
+
+def close_db_pool() -> None:
+
+    """
+        Closes all the connections of the pool if it's open.
+    """
+
+    global db_pool
+
+    if db_pool is not None:
+        db_pool.closeall()
+        db_pool = None
+        with prepare_lock:
+            prepared_connections.clear()
+
+@contextlib.contextmanager
+def db_connection(snapshot: bool = False):
+
+    """
+        Borrows a connection from the pool for the with-block. The connection is read-only.
+        The transaction is rolled back and the connection returned to the pool when the block ends.
+
+        snapshot - If True, the transaction is REPEATABLE READ, so all the queries of the block see the DB as it was at the first query
+    """
+
+    conn = db_pool.getconn()
+    try:
+        if snapshot:
+            conn.set_session(isolation_level=extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+        else:
+            conn.set_session(isolation_level="DEFAULT", readonly=True)
+        yield conn
+    finally:
+        if not conn.closed:
+            conn.rollback()
+        # A broken connection is closed instead of returning it to the pool
+        db_pool.putconn(conn, close=bool(conn.closed))
+        if conn.closed:
+            with prepare_lock:
+                prepared_connections.pop(id(conn), None)
+
+def execute_prepared(curs, name: str, params: tuple = ()) -> None:
+
+    """
+        Executes one of the prepared_statements with the cursor. The statement is prepared on the first use on each connection,
+        so the DB plans the query only once per connection.
+        Server-side cursors can't be declared for an EXECUTE, so the streamed index rows are queried without a prepared statement.
+
+        curs - Cursor of a connection from db_connection
+        name - Key of the statement in prepared_statements
+        params - Parameters of the statement
+    """
+
+    with prepare_lock:
+        prepared = prepared_connections.setdefault(id(curs.connection), set())
+
+    # The connection is used by one thread at a time, so the set of the connection can be changed without the lock
+    if name not in prepared:
+        curs.execute(f"prepare {name} as {prepared_statements[name]}")
+        prepared.add(name)
+
+    if params:
+        curs.execute(f"execute {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        curs.execute(f"execute {name}")
+
+def select_datasets(conn, stac_ids: list | None = None) -> list:
+
+    """
+        Returns the accessible datasets of the given STAC Collection IDs, or all the datasets with a STAC ID, as dictionaries.
+
+        conn - Connection from db_connection
+        stac_ids - List of the STAC Collection IDs, if None or empty all the datasets with a STAC ID are returned
+    """
+
+    with conn.cursor() as curs:
+        if stac_ids:
+            execute_prepared(curs, "select_datasets", (list(stac_ids),))
+        else:
+            execute_prepared(curs, "select_all_datasets")
+
+        return [dict(zip(dataset_columns, result)) for result in curs]
+
+def stream_index_rows(conn, data_ids: list, itersize: int = 2000):
+
+    """
+        Queries the index_wgs84 rows of all the given datasets at once with a server-side cursor, so the rows are fetched in batches.
+        Yields the data_id and an iterator of its rows as dictionaries for every given data_id in the given order.
+        The rows of a dataset need to be gone through before moving to the next dataset. Datasets without rows get an empty iterator.
+
+        conn - Connection to the Paituli DB
+        data_ids - List of the data_ids in the order they are processed
+        itersize - Number of rows fetched from the DB at a time
+    """
+
+    columns = ["data_id", "gid", "label", "path", "geojson"]
+    data_ids = list(data_ids)
+
+    with conn.cursor(name="index_rows") as curs:
+        curs.itersize = itersize
+        # The order is compared as text, so it does not depend on the type of the data_id column
+        data = (data_ids, [str(data_id) for data_id in data_ids])
+        query = "select data_id, gid, label, path, ST_AsGeoJSON(geom) from index_wgs84 where data_id=ANY(%s) order by array_position(%s::text[], data_id::text), gid"
+        curs.execute(query, data)
+
+        groups = itertools.groupby(curs, key=lambda result: result[0])
+        group = next(groups, None)
+        for data_id in data_ids:
+            if group and group[0] == data_id:
+                yield data_id, (dict(zip(columns, result)) for result in group[1])
+                group = next(groups, None)
+            else:
+                yield data_id, iter(())
+
+def get_dataset_directories(conn, data_ids: list) -> dict:
+
+    """
+        Returns the deepest directory that contains all the index_wgs84 paths of each dataset, relative to the data root,
+        as a dictionary with the data_ids as keys.
+        The common prefix of the smallest and the largest path is the common prefix of all the paths of the dataset,
+        so only two paths per dataset are fetched.
+
+        conn - Connection from db_connection
+        data_ids - List of the data_ids
+    """
+
+    with conn.cursor() as curs:
+        execute_prepared(curs, "select_dataset_roots", (list(data_ids),))
+        prefixes = {data_id: os.path.commonprefix([first, last]) for data_id, first, last in curs}
+
+    # Cut the prefixes to whole directory names
+    return {data_id: prefix[:prefix.rfind("/") + 1] for data_id, prefix in prefixes.items()}
+
+def get_dataset_fingerprints(conn, data_ids: list) -> dict:
+
+    """
+        Returns a fingerprint of the index_wgs84 rows of each dataset as a dictionary with the data_ids as keys.
+        The fingerprint is made of the number of rows, the largest gid and a hash of the gids, paths and labels,
+        so it changes when a row is added, removed or changed.
+
+        conn - Connection from db_connection
+        data_ids - List of the data_ids
+    """
+
+    with conn.cursor() as curs:
+        execute_prepared(curs, "select_dataset_fingerprints", (list(data_ids),))
+
+        return {data_id: f"{count}:{max_gid}:{rows_hash}" for data_id, count, max_gid, rows_hash in curs}
@@ -0,0 +1,128 @@
+import os
+import copy
+import json
+import pystac
+import rasterio
+from rio_stac.stac import create_stac_item
+
+from utils.sqlite_store import create_store, open_store, close_store, store_open
+
+# The raster header metadata of the files with the href and the version of the file as the key
+# The headers read without the rio-stac Item are kept in their own table, so they are not taken for the full metadata
+cache = create_store()
+raster_metadata_schema = [
+    """
+        create table if not exists raster_metadata (
+            href text not null,
+            version text not null,
+            metadata text not null,
+            primary key (href, version)
+        )
+    """,
+    """
+        create table if not exists raster_headers (
+            href text not null,
+            version text not null,
+            metadata text not null,
+            primary key (href, version)
+        )
+    """
+]
+
+def open_metadata_cache(cache_dir: str | None = None) -> None:
+
+    """
+        Opens the persistent cache of the raster header metadata. Until this is called, every file is read from the source.
+
+        cache_dir - Directory of the cache database, the .cache directory next to the scripts if not given
+    """
+
+    open_store(cache, "raster_metadata.sqlite", raster_metadata_schema, cache_dir)
+
+def close_metadata_cache() -> None:
+
+    """
+        Closes the raster metadata cache if it's open.
+    """
+
+    close_store(cache)
+
+def read_raster_metadata(href: str, version: str | None, with_item: bool = True) -> dict:
+
+    """
+        Returns the header metadata of the raster as a dictionary with the keys:
+         - gsd: Resolution of the first axis
+         - shape: Shape of the raster
+         - transform: The affine transform as a list of 9 values
+         - epsg: EPSG code of the CRS or None if the raster has no CRS
+         - item: Dictionary of the STAC Item rio-stac makes from the file, without the assets. Contains the footprint, bbox and proj-properties.
+                 Left out if with_item is False
+
+        The file is opened once and the open dataset is given to rio-stac, so the header is not read twice.
+        If the metadata cache is open and a version is given, the metadata is cached with the href and the version as the key,
+        so an unchanged file is not read again on later runs.
+
+        href - Path or URL of the raster
+        version - String telling the version of the file, for example the Last-Modified header. If None, the metadata is not cached
+        with_item - If False, only the header fields are read and the rio-stac Item with its footprint is not made
+    """
+
+    use_cache = store_open(cache) and version is not None
+    table = "raster_metadata" if with_item else "raster_headers"
+
+    if use_cache:
+        with cache["lock"]:
+            row = cache["connection"].execute(f"select metadata from {table} where href=? and version=?", (href, version)).fetchone()
+        if row:
+            return json.loads(row[0])
+
+    with rasterio.open(href) as src:
+        metadata = {
+            "gsd": float(src.res[0]),
+            "shape": list(src.shape),
+            "transform": [
+                src.transform.a,
+                src.transform.b,
+                src.transform.c,
+                src.transform.d,
+                src.transform.e,
+                src.transform.f,
+                src.transform.g,
+                src.transform.h,
+                src.transform.i
+            ],
+            "epsg": src.crs.to_epsg(confidence_threshold=50) if src.crs else None
+        }
+        if with_item:
+            item = create_stac_item(src, id=os.path.basename(href), with_proj=True)
+            item_dict = item.to_dict(include_self_link=False)
+            del item_dict["assets"]
+            metadata["item"] = item_dict
+
+    # Go through JSON also when not cached, so the result is the same with and without the cache
+    metadata_json = json.dumps(metadata)
+
+    if use_cache:
+        with cache["lock"]:
+            cache["connection"].execute(
+                f"insert or replace into {table} (href, version, metadata) values (?, ?, ?)",
+                (href, version, metadata_json)
+            )
+            cache["connection"].commit()
+
+    return json.loads(metadata_json)
+
+def create_item_from_metadata(metadata: dict, item_id: str, assets: dict) -> pystac.Item:
+
+    """
+        Makes a STAC Item with the given ID and assets from the metadata returned by read_raster_metadata.
+    """
+
+    item_dict = copy.deepcopy(metadata["item"])
+    item_dict["id"] = item_id
+    item_dict["assets"] = {}
+    item = pystac.Item.from_dict(item_dict, preserve_dict=False)
+    for key, asset in assets.items():
+        item.add_asset(key=key, asset=asset)
+
+    return item
@@ -1,21 +1,69 @@
+import time
+import heapq
+import random
+from concurrent.futures import ThreadPoolExecutor
 from pystac import Item
 
-def retry_errors(list_of_items, list_of_errors):
+def backoff_delay(attempt: int, base_delay: float = 1.0, max_delay: float = 60.0) -> float:
+
+    """
+    Returns the time to wait before the given retry attempt. The delay doubles with each attempt up to max_delay,
+    and a random part of it is taken so the retries of different links don't hit the server at the same time.
+    """
+
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+def retry_errors(list_of_items, list_of_errors, fetch=Item.from_file, max_attempts=5, base_delay=1.0, max_delay=60.0, workers=4):
     """
     Function to retry retrieving the items that were timed out during the process.
-    
+    Each link is retried after a growing, randomized delay until it's retrieved or max_attempts retries have failed.
+    The links that are due at the same time are retried concurrently. A summary is printed at the end.
+
     list_of_items - List containing the STAC items from the source. The errored items will be appended to this list when successfully retrieved
-    list_of_errors - List of links to the items that timed out during the retrieving process. Function will run until this list is empty
+    list_of_errors - List of links to the items that timed out during the retrieving process. When the function returns, the list contains only the links that could not be retrieved
+    fetch - Function that takes a link and returns the item
+    max_attempts - Number of retries for each link before it's given up
+    base_delay - Seconds to wait before the first retry, doubled for each following retry
+    max_delay - Maximum number of seconds to wait before a retry
+    workers - Number of concurrent retries
+
+    Returns the list of the links that were given up, with the last error of each
     """
 
-    print(" * Trying to add items that timedout")
-    while len(list_of_errors) > 0:
-        for item in list_of_errors:
-            try:
-                list_of_items.append(Item.from_file(item))
-                print(f" * Listed {item}")
-                list_of_errors.remove(item)
-            except Exception as e:
-                print(f" ! {e} on {item}")
-
-    return
\ No newline at end of file
+    def try_fetch(link):
+        try:
+            return fetch(link), None
+        except Exception as e:
+            return None, e
+
+    print(f" * Retrying {len(list_of_errors)} items that timed out")
+    # The links waiting for a retry, ordered by the time of their next attempt
+    scheduled = [(time.monotonic() + backoff_delay(1, base_delay, max_delay), i, link, 1) for i, link in enumerate(list_of_errors)]
+    heapq.heapify(scheduled)
+    dead_letters = []
+    retrieved = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while scheduled:
+            time.sleep(max(0, scheduled[0][0] - time.monotonic()))
+
+            due = []
+            while scheduled and scheduled[0][0] <= time.monotonic():
+                due.append(heapq.heappop(scheduled))
+
+            for (_, i, link, attempt), (item, error) in zip(due, executor.map(try_fetch, [entry[2] for entry in due])):
+                if item is not None:
+                    list_of_items.append(item)
+                    retrieved += 1
+                    print(f" * Listed {link}")
+                elif attempt >= max_attempts:
+                    dead_letters.append({"link": link, "attempts": attempt, "error": str(error)})
+                    print(f" ! Giving up on {link} after {attempt} retries: {error}")
+                else:
+                    print(f" ! {error} on {link}, retry {attempt}/{max_attempts}")
+                    heapq.heappush(scheduled, (time.monotonic() + backoff_delay(attempt + 1, base_delay, max_delay), i, link, attempt + 1))
+
+    list_of_errors[:] = [dead_letter["link"] for dead_letter in dead_letters]
+    print(f" * Retried items: {retrieved} retrieved, {len(dead_letters)} given up")
+
+    return dead_letters
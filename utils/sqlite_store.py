@@ -0,0 +1,59 @@
+import os
+import sqlite3
+import threading
+
+# The caches are kept next to the scripts, so the same databases are used whatever the working directory of the run is
+default_cache_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), ".cache")
+
+def create_store() -> dict:
+
+    """
+        Returns the dictionary of a local SQLite database used by the caches and the stores of the scripts:
+         - connection: The open connection or None until open_store is called
+         - lock: Lock held while the connection is used, so the database can be used from the worker threads
+    """
+
+    return {"connection": None, "lock": threading.Lock()}
+
+def open_store(store: dict, filename: str, schema: list, cache_dir: str | None = None) -> sqlite3.Connection:
+
+    """
+        Opens the database file in the cache directory to the store and runs the schema statements in it.
+        The database is in WAL mode, so reading it does not block the writes. Returns the connection.
+
+        store - Dictionary from create_store
+        filename - Name of the database file in the cache directory
+        schema - List of the SQL statements run when the database is opened, for example the create table statements
+        cache_dir - Directory of the database, default_cache_dir if not given. A relative directory is taken relative to the scripts
+    """
+
+    cache_dir = os.path.join(os.path.dirname(default_cache_dir), cache_dir) if cache_dir else default_cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    with store["lock"]:
+        connection = sqlite3.connect(os.path.join(cache_dir, filename), check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        for statement in schema:
+            connection.execute(statement)
+        connection.commit()
+        store["connection"] = connection
+
+    return connection
+
+def close_store(store: dict) -> None:
+
+    """
+        Closes the database of the store if it's open.
+    """
+
+    with store["lock"]:
+        if store["connection"] is not None:
+            store["connection"].close()
+            store["connection"] = None
+
+def store_open(store: dict) -> bool:
+
+    """
+        Returns True if the database of the store has been opened.
+    """
+
+    return store["connection"] is not None
@@ -0,0 +1,73 @@
+import requests
+import pystac
+from urllib.parse import quote
+
+# Added for easy log-filtering
+log_headers = {"User-Agent": "update-script"}
+
+def get_items_url(collection: pystac.Collection) -> str:
+
+    """
+        Returns the URL of the items endpoint of a Collection opened through pystac_client.
+    """
+
+    items_link = collection.get_single_link("items")
+    if items_link:
+        return items_link.href
+
+    return f"{collection.get_self_href().rstrip('/')}/items"
+
+def iter_item_dicts(collection: pystac.Collection, fields: tuple = ("id",), limit: int = 10000, session: requests.Session | None = None):
+
+    """
+        Pages through the items endpoint of the Collection and yields the Items as plain dictionaries.
+        Only the given fields are requested, so the pages stay small. If the API does not support the fields parameter,
+        the full Items are returned, but they are still not turned into pystac Items.
+        The next links are followed until the last page. The page size is capped by the API if the limit is too large.
+
+        collection - Collection opened through pystac_client
+        fields - The Item fields to request
+        limit - Number of Items asked per page
+        session - Session used for the requests. If not given, a session is opened for the paging and closed after it
+    """
+
+    if session is None:
+        with requests.Session() as own_session:
+            yield from iter_item_dicts(collection, fields, limit, own_session)
+        return
+
+    url = get_items_url(collection)
+    params = {"limit": limit, "fields": ",".join(fields)}
+
+    while url:
+        r = session.get(url, params=params, headers=log_headers)
+        r.raise_for_status()
+        page = r.json()
+        yield from page.get("features", [])
+
+        # The next link contains the query parameters of the following page
+        url = next((link["href"] for link in page.get("links", []) if link.get("rel") == "next"), None)
+        params = None
+
+def get_item(collection: pystac.Collection, item_id: str, session: requests.Session) -> pystac.Item:
+
+    """
+        Returns a single full Item of the Collection from the items endpoint.
+
+        collection - Collection opened through pystac_client
+        item_id - ID of the Item
+        session - Session used for the request
+    """
+
+    r = session.get(f"{get_items_url(collection).rstrip('/')}/{quote(item_id, safe='')}", headers=log_headers)
+    r.raise_for_status()
+
+    return pystac.Item.from_dict(r.json())
+
+def get_item_ids(collection: pystac.Collection, limit: int = 10000) -> set:
+
+    """
+        Returns the set of the Item IDs in the Collection. Only the IDs are requested from the API.
+    """
+
+    return {item["id"] for item in iter_item_dicts(collection, ("id",), limit)}
@@ -0,0 +1,251 @@
+import json
+import time
+import hashlib
+import pystac
+
+from utils.stac_api import get_item_ids
+from utils.sqlite_store import create_store, open_store, close_store, store_open
+
+# The Items published to the hosts, the reconciled Collections, the dataset fingerprints and the IDs of the source links
+store = create_store()
+store_settings = {
+    "host": None,
+    "max_age": 7 * 24 * 60 * 60
+}
+
+published_items_schema = [
+    """
+        create table if not exists published_items (
+            host text not null,
+            collection_id text not null,
+            item_id text not null,
+            href text,
+            content_hash text,
+            uploaded real,
+            primary key (host, collection_id, item_id)
+        )
+    """,
+    """
+        create table if not exists reconciled_collections (
+            host text not null,
+            collection_id text not null,
+            reconciled real not null,
+            primary key (host, collection_id)
+        )
+    """,
+    """
+        create table if not exists dataset_fingerprints (
+            host text not null,
+            data_id text not null,
+            fingerprint text not null,
+            updated real not null,
+            primary key (host, data_id)
+        )
+    """,
+    """
+        create table if not exists source_links (
+            host text not null,
+            collection_id text not null,
+            link text not null,
+            item_id text not null,
+            primary key (host, collection_id, link)
+        )
+    """
+]
+
+def open_state_store(host: str, cache_dir: str | None = None, max_age: int = 7 * 24 * 60 * 60) -> None:
+
+    """
+        Opens the local store of the Items published to the host. Until this is called, the remote IDs are fetched on every run.
+
+        host - The host the Items are published to, the Items of each host are stored separately
+        cache_dir - Directory of the store database, the .cache directory next to the scripts if not given
+        max_age - Seconds after which a Collection is reconciled against the STAC API again
+    """
+
+    open_store(store, "published_items.sqlite", published_items_schema, cache_dir)
+    store_settings["host"] = host
+    store_settings["max_age"] = max_age
+
+def close_state_store() -> None:
+
+    """
+        Closes the state store if it's open.
+    """
+
+    close_store(store)
+
+def hash_content(item_dict: dict) -> str:
+
+    """
+        Returns the MD5 hash of the Item dictionary with the keys sorted, so the same content gives the same hash.
+    """
+
+    return hashlib.md5(json.dumps(item_dict, sort_keys=True).encode()).hexdigest()
+
+def record_published(collection_id: str, item_id: str, href: str | None, item_dict: dict) -> None:
+
+    """
+        Records an Item that the host has accepted. Called after a successful POST or PUT of the Item.
+        Does nothing if the store is not open.
+
+        collection_id - ID of the Collection the Item was published to
+        item_id - ID of the Item
+        href - HREF of the source file of the Item
+        item_dict - The Item as it was sent
+    """
+
+    if not store_open(store):
+        return
+
+    content_hash = hash_content(item_dict)
+    with store["lock"], store["connection"]:
+        store["connection"].execute(
+            "insert or replace into published_items (host, collection_id, item_id, href, content_hash, uploaded) values (?, ?, ?, ?, ?, ?)",
+            (store_settings["host"], collection_id, item_id, href, content_hash, time.time())
+        )
+
+def get_published_ids(collection_id: str) -> set:
+
+    """
+        Returns the IDs of the Items recorded for the Collection.
+    """
+
+    with store["lock"]:
+        rows = store["connection"].execute(
+            "select item_id from published_items where host=? and collection_id=?",
+            (store_settings["host"], collection_id)
+        ).fetchall()
+
+    return {row[0] for row in rows}
+
+def needs_reconcile(collection_id: str) -> bool:
+
+    """
+        Returns True if the Collection has never been reconciled against the STAC API or the last reconciliation is too old.
+    """
+
+    with store["lock"]:
+        row = store["connection"].execute(
+            "select reconciled from reconciled_collections where host=? and collection_id=?",
+            (store_settings["host"], collection_id)
+        ).fetchone()
+
+    return row is None or time.time() - row[0] > store_settings["max_age"]
+
+def reconcile_collection(collection_id: str, remote_ids: set) -> None:
+
+    """
+        Makes the recorded Items of the Collection match the IDs in the STAC API in one transaction.
+        Items missing from the API are removed and Items missing from the store are added without a href or a hash.
+    """
+
+    host = store_settings["host"]
+    with store["lock"], store["connection"]:
+        local_ids = {row[0] for row in store["connection"].execute(
+            "select item_id from published_items where host=? and collection_id=?",
+            (host, collection_id)
+        )}
+        store["connection"].executemany(
+            "delete from published_items where host=? and collection_id=? and item_id=?",
+            [(host, collection_id, item_id) for item_id in local_ids - remote_ids]
+        )
+        store["connection"].executemany(
+            "insert into published_items (host, collection_id, item_id) values (?, ?, ?)",
+            [(host, collection_id, item_id) for item_id in remote_ids - local_ids]
+        )
+        store["connection"].execute(
+            "insert or replace into reconciled_collections (host, collection_id, reconciled) values (?, ?, ?)",
+            (host, collection_id, time.time())
+        )
+
+def get_collection_item_ids(collection: pystac.Collection, reconcile: bool = False) -> set:
+
+    """
+        Returns the IDs of the Items already in the Collection.
+        The IDs are read from the state store. The Collection is reconciled against the STAC API first
+        if asked, if it has not been reconciled before or if the last reconciliation is too old.
+        Without an open store, the IDs are always fetched from the STAC API.
+
+        collection - Collection opened through pystac_client
+        reconcile - If True, the IDs are fetched from the STAC API and the store is updated with them
+    """
+
+    if not store_open(store):
+        return get_item_ids(collection)
+
+    if reconcile or needs_reconcile(collection.id):
+        remote_ids = get_item_ids(collection)
+        reconcile_collection(collection.id, remote_ids)
+        print(f" * Reconciled {collection.id} against the STAC API")
+        return remote_ids
+
+    return get_published_ids(collection.id)
+
+def get_recorded_fingerprints() -> dict:
+
+    """
+        Returns the fingerprints of the datasets recorded after their last successful update, with the data_ids as strings as the keys.
+        Returns an empty dictionary if the store is not open.
+    """
+
+    if not store_open(store):
+        return {}
+
+    with store["lock"]:
+        rows = store["connection"].execute("select data_id, fingerprint from dataset_fingerprints where host=?", (store_settings["host"],)).fetchall()
+
+    return {row[0]: row[1] for row in rows}
+
+def record_dataset_fingerprint(data_id, fingerprint: str) -> None:
+
+    """
+        Records the fingerprint of the dataset after all of its Items have been uploaded. Does nothing if the store is not open.
+    """
+
+    if not store_open(store):
+        return
+
+    with store["lock"], store["connection"]:
+        store["connection"].execute(
+            "insert or replace into dataset_fingerprints (host, data_id, fingerprint, updated) values (?, ?, ?, ?)",
+            (store_settings["host"], str(data_id), fingerprint, time.time())
+        )
+
+def get_source_link_ids(collection_id: str) -> dict:
+
+    """
+        Returns the Item IDs recorded for the source Item links of the Collection, with the links as the keys.
+        Returns an empty dictionary if the store is not open.
+    """
+
+    if not store_open(store):
+        return {}
+
+    with store["lock"]:
+        rows = store["connection"].execute(
+            "select link, item_id from source_links where host=? and collection_id=?",
+            (store_settings["host"], collection_id)
+        ).fetchall()
+
+    return {row[0]: row[1] for row in rows}
+
+def record_source_links(collection_id: str, link_ids: dict) -> None:
+
+    """
+        Records the Item IDs of the downloaded source Item links, so the links of the published Items are not downloaded again.
+        Does nothing if the store is not open.
+
+        collection_id - ID of the Collection the Items belong to
+        link_ids - Dictionary with the source Item links as the keys and the Item IDs as the values
+    """
+
+    if not store_open(store):
+        return
+
+    host = store_settings["host"]
+    with store["lock"], store["connection"]:
+        store["connection"].executemany(
+            "insert or replace into source_links (host, collection_id, link, item_id) values (?, ?, ?, ?)",
+            [(host, collection_id, link, item_id) for link, item_id in link_ids.items()]
+        )